@@ -1,41 +1,202 @@
+# Startup timing (ASTHMA_PROFILE_STARTUP=1 logs the wall time of each phase)
+from profiling import StartupTimer
+startup = StartupTimer()
+
 import dash
 from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output
 import pandas as pd
 import numpy as np
-import statsmodels.formula.api as sm
-from scipy.stats import pearsonr
-from statsmodels.compat import lzip
-import statsmodels.stats.api as sms
-import plotly.graph_objects as go
-df = pd.read_csv('Data/Master_Data.csv', converters={'countyfips': str})
-
-# Add Code
-def fips_code(x):
-    if len(x) == 4:
-        return "0" + str(x)
-    else:
-        return str(x)
-# Apply function
-df['countyfips'] = df['countyfips'].apply(fips_code)
-
-# Unique State and Countys
-# States
-states = df['statedesc'].unique()
-states = sorted(states)
-# Countys
-countys = df['countyname'].unique()
-countys = sorted(countys)
-
+import os
+import logging
+import json
+import gc
+import functools
+import flask
 # Import ploty and other dependancies
 import plotly.express as px
-from urllib.request import urlopen
-import json
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    counties = json.load(response)
+# County geometry is bundled in Data/geo and loaded on first use, tract
+# geometry per State when its tracts are shown
+from geometry import load_counties, county_index, county_subset, tract_subset, DEFAULT_LEVEL
+from cache import FigureCache, SharedFigureCache, quantize
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+logger = logging.getLogger('asthma')
+startup.phase('imports')
+
+# Census tract mode: the model runs on the tracts of Data/tract (python
+# pipeline.py tracts) and the County and State views aggregate them
+TRACTS = os.environ.get('ASTHMA_TRACTS', '0') == '1'
+
+# Memory-map the columnar store of Master_Data.csv (rebuilt when the CSV
+# changes), or the tract store
+from store import load_dataset, load, MANIFEST, partitions, partition_dir, year_dir
+from regions import tract_counties
+from pipeline import TRACT_STORE, BASE_YEAR
+if TRACTS:
+    tracts = load(TRACT_STORE)
+    df, tract_county = tract_counties(tracts)
+else:
+    df = load_dataset()
+startup.phase('data load')
+
+# Load Fixed Effects Model (refit only when Master_Data.csv changes)
+from model import load_model, coefficients, MASTER_DATA, TRACT_MODEL_ARTIFACT, YEAR_MODEL_ARTIFACT
+if TRACTS:
+    model_data_path = os.path.join(TRACT_STORE, MANIFEST)
+    fixed_model = load_model(tracts, model_data_path, TRACT_MODEL_ARTIFACT)
+else:
+    model_data_path = MASTER_DATA
+    fixed_model = load_model(df)
+startup.phase('model load')
+
+# Pollutant of the model's State emissions and of the emissions slider
+from pollutants import MODEL_POLLUTANT, PM25
+POLLUTANT_NAME = 'Particulate Matter 2.5 (PM 2.5)' if MODEL_POLLUTANT == PM25 else MODEL_POLLUTANT.label
+
+from scenario import ScenarioEngine, ScenarioCube, GroupedEngine, impact_columns, ASTHMA_COST, MONETARY_UNIT
+from regions import RegionIndex, StateRollup
+import bootstrap
+import optimizer
+
+
+## Years ##
+
+class YearData:
+    """A year's dataset and everything the callbacks derive from it.
+
+    The model was fit on the file at ``data_path``; the year's bootstrap
+    draws are cached at ``bootstrap_path`` by ``bootstrap_command``, a build
+    step like the model's, and the intervals are not available until then.
+    """
+
+    def __init__(self, year, df, fixed_model, data_path, bootstrap_path, bootstrap_command, engine=None, cube_path=None):
+        self.year = year
+        self.df = df
+        # Figures are cached under the hash of the data they were drawn from
+        self.version = fixed_model['data_hash']
+
+        # Precompute per-county scenario terms
+        if engine is None:
+            engine = ScenarioEngine(df['net_growth_19to64'], df['casthma_adjprev'], *coefficients(fixed_model))
+        self.engine = engine
+
+        # State and County lookup for the dropdowns
+        self.regions = RegionIndex(df['statedesc'], df['countyfips'])
+        self.rollup = StateRollup(df['stateabbr'], df['statedesc'])
+
+        # Precompute every slider position, by county and by State
+        self.cube = ScenarioCube(engine, self.rollup, path=cube_path)
+        logger.info('Scenario cube %s: %.1f MB built in %.1f ms', year, self.cube.nbytes / 2**20, self.cube.build_seconds * 1000)
+
+        # Columns needed by the map. Callbacks never modify the base dataset, every
+        # request builds its own result frame so concurrent requests can't interfere.
+        self.base = df[['stateabbr', 'statedesc', 'countyname', 'countyfips', 'totalpopulation', 'casthma_adjprev']].copy()
+
+        # Asthma rates don't depend on the sliders, aggregate them once
+        _, (state_population, state_asthma_cases) = self.rollup.sum(np.stack([
+            df['totalpopulation'].to_numpy(dtype=float),
+            (df['totalpopulation'] * df['casthma_adjprev']).to_numpy()]))
+        self.state_rates = pd.DataFrame({
+            'stateabbr': self.rollup.stateabbr,
+            'statedesc': self.rollup.statedesc,
+            'Asthma_Rate': state_asthma_cases / state_population})
+
+        # Bootstrap draws of the coefficients for the confidence intervals
+        self.data_path, self.bootstrap_path = data_path, bootstrap_path
+        self.bootstrap_command = bootstrap_command
+        self.draws = bootstrap.read_draws(data_path, bootstrap_path)
+        if self.draws is None:
+            logger.warning('No bootstrap draws of %s, run %s for its confidence intervals', year, bootstrap_command)
+
+    def current_draws(self):
+        # Picked up once the bootstrap has been run
+        if self.draws is None:
+            self.draws = bootstrap.read_draws(self.data_path, self.bootstrap_path)
+        return self.draws
+
+
+if TRACTS:
+    # County impacts are the sums of their tracts' impacts
+    tract_engine = ScenarioEngine(tracts['net_growth_19to64'], tracts['casthma_adjprev'], *coefficients(fixed_model))
+    base_year = YearData(BASE_YEAR, df, fixed_model, model_data_path, bootstrap.TRACT_BOOTSTRAP_ARTIFACT,
+                         'python bootstrap.py tracts',
+                         engine=GroupedEngine(tract_engine, tract_county, len(df)),
+                         cube_path=os.environ.get('ASTHMA_SCENARIO_CUBE'))
+else:
+    # (set ASTHMA_SCENARIO_CUBE to a .npy path to memory-map the cube)
+    base_year = YearData(BASE_YEAR, df, fixed_model, model_data_path, bootstrap.BOOTSTRAP_ARTIFACT, 'python bootstrap.py',
+                         cube_path=os.environ.get('ASTHMA_SCENARIO_CUBE'))
+startup.phase('scenarios')
+
+# Years with a partition of the store (python pipeline.py year <year>) next
+# to the base year of Master_Data.csv, a year is only read once selected
+YEARS = [BASE_YEAR] if TRACTS else sorted(set([BASE_YEAR] + partitions()))
+# Years kept loaded
+YEARS_LOADED = 4
+
+
+@functools.lru_cache(maxsize=YEARS_LOADED)
+def load_year(year):
+    partition = partition_dir(year)
+    year_df = load(partition)
+    data_path = os.path.join(partition, MANIFEST)
+    year_model = load_model(year_df, data_path, os.path.join(year_dir(year), YEAR_MODEL_ARTIFACT))
+    return YearData(year, year_df, year_model, data_path, os.path.join(year_dir(year), bootstrap.YEAR_BOOTSTRAP_ARTIFACT),
+                    'python bootstrap.py year {}'.format(year))
+
+
+def year_data(Year):
+    # The base year is the dataset loaded at startup
+    if Year is None or Year == BASE_YEAR:
+        return base_year
+    return load_year(Year)
+
+
+# States
+states = base_year.regions.states
+# Countys (keyed by FIPS code, county names repeat across States)
+countys = sorted(zip(df['countyname'] + ', ' + df['stateabbr'], df['countyfips']))
+
+# Geometry is otherwise loaded by the first request, time it when profiling
+if startup.enabled:
+    load_counties()
+    startup.phase('geometry load')
+
+## Metrics ##
+
+MONETARY = 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)'
+CASES = 'Total Reduced Asthma Cases'
+RATES = 'Asthma Rates'
+
+# Recompute slider scenarios in the browser instead of on the server (not
+# in tract mode, the browser would need every tract's terms)
+CLIENTSIDE = os.environ.get('ASTHMA_CLIENTSIDE', '0') == '1' and not TRACTS
+
+# Default costs of a percentage point of every factor in a State and the
+# default budget (USD) of the optimizer
+OPTIMIZER_COSTS = (5000000, 2000000, 3000000)
+OPTIMIZER_BUDGET = 250000000
+
+
+def scenario_terms(data):
+    # Per-county scenario terms shipped to the browser in clientside mode,
+    # once and again when another year is selected
+    return {
+        'coefs': data.engine.coefs.tolist(),
+        'net_growth': data.engine.net_growth.tolist(),
+        'asthma_rate': data.engine.asthma_rate.tolist(),
+        'state_codes': data.rollup.codes.tolist(),
+        'state_names': data.rollup.statedesc.tolist(),
+        'asthma_cost': ASTHMA_COST,
+        'monetary_unit': MONETARY_UNIT,
+        'monetary': MONETARY,
+        'rates': RATES,
+    }
 
 app = dash.Dash(__name__)
+# WSGI entry point of multi-worker servers (gunicorn.conf.py)
+server = app.server
 
 app.layout = html.Div([
     html.Div(children=[
@@ -77,10 +238,10 @@ app.layout = html.Div([
                     className="dashboard-description"
                 ),
                 dcc.Markdown('''
-                    * Reduced Particulate Matter 2.5 (PM 2.5) Emissions
+                    * Reduced {} Emissions
                     * Reduced Smoking Rates (Among individuals ages 19 to 64)
                     * Increased health care accessibility (Among individuals ages 19 to 64)                  
-                '''),
+                '''.format(POLLUTANT_NAME)),
                 html.H3(
                     children="Github Repository", className="github-heading"
                 ),
@@ -104,9 +265,21 @@ app.layout = html.Div([
             options=[
                 {'label': 'State', 'value': 'ST'},
                 {'label': 'County', 'value': 'CT'}
-            ],
+            ] + ([{'label': 'Tract (select a State)', 'value': 'TR'}] if TRACTS else []),
             value='CT'
         ),
+
+        # Only shown when the store has more than one year
+        html.Div(children=[
+            html.Br(),
+            html.H4('Year'),
+            html.Label('View the data of a year'),
+            dcc.RadioItems(id='year-selected',
+                options=[{'label': str(year), 'value': year} for year in YEARS],
+                value=BASE_YEAR,
+                inline=True
+            ),
+        ], style={} if len(YEARS) > 1 else {'display': 'none'}),
         
         html.Br(),
         html.H4('Metric Selected'),
@@ -131,12 +304,12 @@ app.layout = html.Div([
         html.Br(),
         html.H4('County Dropdown'),
         dcc.Dropdown(id="county-filter",
-            options=[{'value': x, 'label': x}
-                       for x in countys], multi=True
+            options=[{'value': fips, 'label': name}
+                       for name, fips in countys], multi=True
         ),  ], style={'display': 'inline-block', 'vertical-align': 'top', 'margin-left': '3vw', 'margin-top': '3vw', 'width': '25%'}),
 
     html.Div(children=[   
-        html.H4('Reduced PM 2.5 Emissions Percentage Impact'),
+        html.H4('Reduced {} Emissions Percentage Impact'.format(MODEL_POLLUTANT.label)),
         dcc.Slider(
             id = "emissions-slider",
             min=0,
@@ -173,7 +346,39 @@ app.layout = html.Div([
     html.Div(id='metric-selected-container', style = {'padding-top':'5%'}),
     
     html.Div(children=[
-        dcc.Graph(id="choropleth")], style={'display': 'block', 'vertical-align': 'top', 'margin-left': '3vw', 'margin-top': '3vw'}),
+        # The basemap is served from assets/topojson instead of the plotly CDN
+        dcc.Graph(id="choropleth", config={'topojsonURL': app.get_asset_url('topojson/')})], style={'display': 'block', 'vertical-align': 'top', 'margin-left': '3vw', 'margin-top': '3vw'}),
+    html.Div(id='interval-container', style={'margin-left': '3vw'}),
+    # Clientside mode computes the intervals of new slider values on request
+    html.Button('Update intervals', id='interval-button',
+                style={'margin-left': '3vw'} if CLIENTSIDE else {'display': 'none'}),
+
+    html.Div(children=[
+        html.H4('Budget Optimizer'),
+        html.Label('Allocate percentage improvements of every factor across the selected States (all States without a selection) for a high Total Monetary Value of Reduced Asthma Cases within a budget: a total budget is allocated greedily (an approximation), a budget for every State exactly'),
+        html.Br(), html.Br(),
+        html.Label('Cost of one percentage point in a State (USD): reduced emissions, reduced smoking, increased health care access'),
+        html.Br(),
+        dcc.Input(id='emissions-cost', type='number', min=0, value=OPTIMIZER_COSTS[0]),
+        dcc.Input(id='smoking-cost', type='number', min=0, value=OPTIMIZER_COSTS[1]),
+        dcc.Input(id='healthcare-cost', type='number', min=0, value=OPTIMIZER_COSTS[2]),
+        html.Br(), html.Br(),
+        html.Label('Budget (USD)'),
+        dcc.RadioItems(id='budget-mode',
+            options=[
+                {'label': 'Total across States', 'value': 'total'},
+                {'label': 'For every State', 'value': 'state'}
+            ],
+            value='total',
+            inline=True
+        ),
+        dcc.Input(id='budget', type='number', min=0, value=OPTIMIZER_BUDGET),
+        html.Button('Optimize', id='optimize-button'),
+        html.Div(id='optimizer-summary'),
+        dcc.Graph(id='optimizer-map', config={'topojsonURL': app.get_asset_url('topojson/')}, style={'display': 'none'}),
+    ], style={'margin-left': '3vw', 'margin-top': '3vw'}),
+    dcc.Store(id='scenario-store', data=scenario_terms(base_year) if CLIENTSIDE else None),
+    dcc.Store(id='view-store'),
         
     html.Div(children=[
                 html.H3(
@@ -181,18 +386,18 @@ app.layout = html.Div([
                 ),
                 html.H4('Total Monetary Value of Reduced Asthma Cases ($100,000 USD)'),
                 dcc.Markdown('''
-                    * Reduced_Emissions_Monetary_Impact: Estimated monetary value of reduced asthma cases associated with reduced PM25 emissions
+                    * Reduced_Emissions_Monetary_Impact: Estimated monetary value of reduced asthma cases associated with reduced {} emissions
                     * Reduced_Smoking_Monetary_Impact: Estimated monetary value of reduced asthma cases associated with reduced smoking rates
                     * Increased_Healthcare_Access_Monetary_Impact: Estimated monetary value of reduced asthma cases associated with increased healthcare accessibility
                     * Total_Monetary_Impact: Estimated monetary impact of reduced asthma cases associated with all factors examined                    
-                '''),
+                '''.format(MODEL_POLLUTANT.label)),
                 html.H4('Total Reduced Asthma Cases'),
                 dcc.Markdown('''
-                    * Reduced_Emissions_Impact: Estimated number of reduced asthma cases associated with reduced PM25 emissions
+                    * Reduced_Emissions_Impact: Estimated number of reduced asthma cases associated with reduced {} emissions
                     * Reduced_Smoking_Impact: Estimated number of reduced asthma cases associated with reduced smoking rates
                     * Increased_Healthcare_Access_Impact: Estimated number of reduced asthma cases associated with increased healthcare accessibility
                     * Total_Impact: Estimated number of reduced asthma cases associated with all factors examined
-                '''),
+                '''.format(MODEL_POLLUTANT.label)),
                 html.H4('Asthma Rates'),
                 dcc.Markdown('''
                     * Asthma Rates: Asthma rates across each County or State
@@ -202,24 +407,13 @@ app.layout = html.Div([
         ),
 ], style={'backgroundColor':'#F0F8F9'})
 
-@app.callback(
-    dash.dependencies.Output('emissions-output-container', 'children'),
-    [dash.dependencies.Input('emissions-slider', 'value')])
-def update_output(value):
-    return 'Percentage Impact = "{0:.1f}%"'.format(value)
+# Slider labels are updated in the browser (assets/scenario.js)
+for slider in ['emissions', 'smoking', 'healthcare']:
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='asthma', function_name='percentage_label'),
+        dash.dependencies.Output('{}-output-container'.format(slider), 'children'),
+        [dash.dependencies.Input('{}-slider'.format(slider), 'value')])
 
-@app.callback(
-    dash.dependencies.Output('smoking-output-container', 'children'),
-    [dash.dependencies.Input('smoking-slider', 'value')])
-def update_output(value):
-    return 'Percentage Impact = "{0:.1f}%"'.format(value)
-    
-@app.callback(
-    dash.dependencies.Output('healthcare-output-container', 'children'),
-    [dash.dependencies.Input('healthcare-slider', 'value')])
-def update_output(value):
-    return 'Percentage Impact = "{0:.1f}%"'.format(value)
-    
 @app.callback(
     dash.dependencies.Output('metric-selected-container', 'children'),
     [dash.dependencies.Input('metric-selected', 'value')])
@@ -227,659 +421,657 @@ def update_output(value):
     return html.H2('{}'.format(value))
     
 
-@app.callback(
-    dash.dependencies.Output("choropleth", "figure"),
-    [dash.dependencies.Input("geo-level", "value"),
-    dash.dependencies.Input("state-filter", "value"),
-    dash.dependencies.Input("county-filter", "value"),
-    dash.dependencies.Input("metric-selected", "value"),
-    dash.dependencies.Input("emissions-slider", "value"),
-    dash.dependencies.Input("smoking-slider", "value"),
-    dash.dependencies.Input("healthcare-slider", "value")])
-
-def display_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare):
-
-
 #####################################################################################################################################################################################################################################
 
 
-    ## Run Model ##
-        
-    fixed_model = sm.ols(formula='''casthma_adjprev ~ np.log(state_emissions) + csmoking_adjprev +
-                    access2_adjprev + np.log(per_capita_income) + C(statedesc)''',
-                          data=df).fit()
-                          
-    ## Obtain coefficients ##
-        
-    state_emissions_coef = pd.read_html(fixed_model.summary2().as_html())[1][1][51]
-    state_emissions_coef = f = float(state_emissions_coef)
-    csmoking_adjprev_coef = pd.read_html(fixed_model.summary2().as_html())[1][1][52]
-    csmoking_adjprev_coef = f = float(csmoking_adjprev_coef)
-    access2_adjprev_coef = pd.read_html(fixed_model.summary2().as_html())[1][1][53]
-    access2_adjprev_coef = f = float(access2_adjprev_coef)
-        
-    ## Emissions Impact ##
-        
-    # Estimated number of reduced asthma cases by county
-    df['Reduced_Emissions_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (state_emissions_coef*Emissions))/100))
-    # Convert to int
-    df['Reduced_Emissions_Impact'] = df['Reduced_Emissions_Impact'].astype(int)
-    # Apply monetary societal benefit
-    df['Reduced_Emissions_Monetary_Impact'] =  (df['Reduced_Emissions_Impact'] * 3100) / 100000
-    # State aggregation - monetary societal benefit
-    df['Reduced_Emissions_Monetary_Impact_State'] = (df['Reduced_Emissions_Impact'] * 3100)
-        
-    ## Smoking Impact ##
-        
-    # Estimated number of reduced asthma cases by county
-    df['Reduced_Smoking_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (csmoking_adjprev_coef*Smoking))/100))
-    # Convert to int
-    df['Reduced_Smoking_Impact'] = df['Reduced_Smoking_Impact'].astype(int)
-    # Apply monetary societal benefit
-    df['Reduced_Smoking_Monetary_Impact'] = (df['Reduced_Smoking_Impact'] * 3100) / 100000
-    # State aggregation - monetary societal benefit
-    df['Reduced_Smoking_Monetary_Impact_State'] = (df['Reduced_Smoking_Impact'] * 3100)
-        
-    ## Healthcare Impact ##
-        
-    # Estimated number of reduced asthma cases by county
-    df['Increased_Healthcare_Access_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (-access2_adjprev_coef*Healthcare))/100))
-    # Convert to int
-    df['Increased_Healthcare_Access_Impact'] = df['Increased_Healthcare_Access_Impact'].astype(int)
-    # Apply monetary societal benefit
-    df['Increased_Healthcare_Access_Monetary_Impact'] = (df['Increased_Healthcare_Access_Impact'] * 3100) / 100000
-    # State aggregation - monetary societal benefit
-    df['Increased_Healthcare_Access_Monetary_Impact_State'] = (df['Increased_Healthcare_Access_Impact'] * 3100)
-        
-    ## Total Impact ##
-        
-    # Estimated total number of reduced asthma case by county
-    df['Total_Impact'] = df['Increased_Healthcare_Access_Impact'] + df['Reduced_Smoking_Impact'] + df['Reduced_Emissions_Impact']
-    # Convert to int
-    df['Total_Impact'] = df['Total_Impact'].astype(int)
-    # Apply monetary societal benefit
-    df['Total_Monetary_Impact'] = (df['Total_Impact'] * 3100) / 100000
-    # State aggregation - monetary societal benefit
-    df['Total_Monetary_Impact_State'] = (df['Total_Impact'] * 3100)
-        
+# Color and hover columns of the impact metrics
+IMPACT_COLUMNS = {
+    MONETARY: ('Total_Monetary_Impact', ["Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"]),
+    CASES: ('Total_Impact', ["Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"]),
+}
 
-#####################################################################################################################################################################################################################################
+# Reduced case columns in the order of the hover columns and the total
+CASE_COLUMNS = ["Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact", "Total_Impact"]
 
+## Base Dataset ##
 
-    ### Scenario 1 (Default) ###
-    
-    # View = County
-    # Metric = Monetary Value
-    # State Dropdown = None
-    # County Dropdown = None
-    
-    if Geo == 'CT' and State is None and County is None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)':       
-        
-        fig = px.choropleth(
-            df, geojson=counties, locations='countyfips', color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Monetary_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig
- 
+# Tract mode: tract columns needed by the map and the tract rows by State and County
+if TRACTS:
+    tract_base = tracts[['stateabbr', 'statedesc', 'countyname', 'tractfips', 'totalpopulation', 'casthma_adjprev']].copy()
+    tract_regions = RegionIndex(tracts['statedesc'], tracts['countyfips'])
 
-#####################################################################################################################################################################################################################################
 
+def view_level(Geo, State, County):
+    # Tracts are only drawn for selected States or Counties, zoomed out to
+    # the whole country the map shows their county aggregates
+    if Geo == 'TR' and (not TRACTS or tract_regions.rows(State, County) is None):
+        return 'CT'
+    return Geo
 
-    ### Scenario 2 ###
-    
-    # View = County
-    # Metric = Total Cases
-    # State Dropdown = None
-    # County Dropdown = None
-    
-    if Geo == 'CT' and State is None and County is None and Metric == 'Total Reduced Asthma Cases':       
-        
-        fig = px.choropleth(
-            df, geojson=counties, locations='countyfips', color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
 
-        return fig
+def select_rows(data, frame, State, County):
+    # Apply State and County Dropdowns
+    rows = data.regions.rows(State, County)
+    if rows is None:
+        return frame
+    return frame.iloc[rows]
 
 
-#####################################################################################################################################################################################################################################
+## State Rollups ##
 
+def state_cases(data, rows, Emissions, Smoking, Healthcare):
+    # Reduced cases by State, straight from the cube on the slider grid
+    cases = data.cube.state_impacts(Emissions, Smoking, Healthcare)
+    if cases is None:
+        results = data.cube.evaluate(Emissions, Smoking, Healthcare)
+        return data.rollup.sum(np.stack([results[column] for column in CASE_COLUMNS]), rows)
+    states = data.rollup.present(rows)
+    return states, cases[:, states]
 
-    ### Scenario 3 ###
-    
-    # View = County
-    # Metric = Asthma Rates
-    # State Dropdown = None
-    # County Dropdown = None
 
-    if Geo == 'CT' and State is None and County is None and Metric == 'Asthma Rates':       
-        
-        fig = px.choropleth(
-            df, geojson=counties, locations='countyfips', color='casthma_adjprev',
-            color_continuous_scale="Viridis",
-            range_color=(7, np.max(df['casthma_adjprev'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data={"statedesc"},
-            labels={'casthma_adjprev':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+def state_results(data, rows, Metric, Emissions, Smoking, Healthcare):
+    # Aggregate county results by State
+    if Metric == RATES:
+        if rows is None:
+            return data.state_rates
+        return data.state_rates.iloc[data.rollup.present(rows)].reset_index(drop=True)
 
-        return fig
+    color, hover_data = IMPACT_COLUMNS[Metric]
+    states, cases = state_cases(data, rows, Emissions, Smoking, Healthcare)
+    dff = pd.DataFrame({'stateabbr': data.rollup.stateabbr[states], 'statedesc': data.rollup.statedesc[states]})
+    for column, values in zip(hover_data + [color], cases):
+        if Metric == MONETARY:
+            # Apply monetary societal benefit
+            values = (values * ASTHMA_COST) / MONETARY_UNIT
+        dff[column] = values
+    return dff
 
 
-#####################################################################################################################################################################################################################################
+def choropleth(frame, geojson=None, **kwargs):
+    # Build the figure without the geometry and attach the shared geometry to
+    # the figure dict afterwards, plotly would otherwise deep copy it
+    fig = px.choropleth(
+        frame,
+        color_continuous_scale="Viridis",
+        scope="usa",
+        **kwargs)
+    fig.update_layout(
+        height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+    figure = fig.to_plotly_json()
+    if geojson is not None:
+        figure['data'][0]['geojson'] = geojson
+    return figure
 
 
-    ### Scenario 4 ###
-    
-    # View = State
-    # Metric = Monetary Value
-    # State Dropdown = None
-    # County Dropdown = None
-
-    if Geo == 'ST' and State is None and County is None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)': 
-
-        dff = df.groupby(['stateabbr', 'statedesc']).agg({
-        'Reduced_Emissions_Monetary_Impact_State':'sum',
-        'Reduced_Smoking_Monetary_Impact_State':'sum',
-        'Increased_Healthcare_Access_Monetary_Impact_State':'sum',
-        'Total_Monetary_Impact_State':'sum'
-        }).reset_index()
-        
-        # Emissions Impact
-        dff = dff.rename(columns={'Reduced_Emissions_Monetary_Impact_State': 'Reduced_Emissions_Monetary_Impact'})
-        dff['Reduced_Emissions_Monetary_Impact'] = dff['Reduced_Emissions_Monetary_Impact'].astype(int)
-        dff['Reduced_Emissions_Monetary_Impact'] = dff['Reduced_Emissions_Monetary_Impact'] / 100000
-        
-        # Smoking Impact
-        dff = dff.rename(columns={'Reduced_Smoking_Monetary_Impact_State': 'Reduced_Smoking_Monetary_Impact'})
-        dff['Reduced_Smoking_Monetary_Impact'] = dff['Reduced_Smoking_Monetary_Impact'].astype(int)
-        dff['Reduced_Smoking_Monetary_Impact'] = dff['Reduced_Smoking_Monetary_Impact'] / 100000
-        
-        # Healthcare Impact
-        dff = dff.rename(columns={'Increased_Healthcare_Access_Monetary_Impact_State': 'Increased_Healthcare_Access_Monetary_Impact'})
-        dff['Increased_Healthcare_Access_Monetary_Impact'] = dff['Increased_Healthcare_Access_Monetary_Impact'].astype(int)
-        dff['Increased_Healthcare_Access_Monetary_Impact'] = dff['Increased_Healthcare_Access_Monetary_Impact'] / 100000
-        
-        # Total Impact
-        dff = dff.rename(columns={'Total_Monetary_Impact_State': 'Total_Monetary_Impact'})
-        dff['Total_Monetary_Impact'] = dff['Total_Monetary_Impact'].astype(int)
-        dff['Total_Monetary_Impact'] = dff['Total_Monetary_Impact'] / 100000
-        
-        fig = px.choropleth(
-            dff, locations='stateabbr', locationmode="USA-states", color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(dff['Total_Monetary_Impact'])),
-            scope="usa",
-            hover_name="statedesc",
-            hover_data=["Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+def display_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year=None):
 
-        return fig
+    Geo = view_level(Geo, State, County)
+    data = year_data(Year)
 
 
 #####################################################################################################################################################################################################################################
 
 
-    ### Scenario 5 ###
-    
-    # View = State
-    # Metric = Total Cases
-    # State Dropdown = None
-    # County Dropdown = None
-
-    if Geo == 'ST' and State is None and County is None and Metric == 'Total Reduced Asthma Cases': 
-
-        dff = df.groupby(['stateabbr', 'statedesc']).agg({
-        'Reduced_Emissions_Impact':'sum',
-        'Reduced_Smoking_Impact':'sum',
-        'Increased_Healthcare_Access_Impact':'sum',
-        'Total_Impact':'sum'
-        }).reset_index()
-        
-        fig = px.choropleth(
-            dff, locations='stateabbr', locationmode="USA-states", color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(dff['Total_Impact'])),
-            scope="usa",
-            hover_name="statedesc",
-            hover_data=["Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig
-
-
-#####################################################################################################################################################################################################################################
-
- 
-    ### Scenario 6 ###
-    
-    # View = State
-    # Metric = Asthma Rates
-    # State Dropdown = None
-    # County Dropdown = None 
- 
-    if Geo == 'ST' and State is None and County is None and Metric == 'Asthma Rates': 
-
-        df['Total_Asthma_Cases'] = df['totalpopulation'] * df['casthma_adjprev']
-        
-        dff = df.groupby(['stateabbr', 'statedesc']).agg({
-        'totalpopulation':'sum',
-        'Total_Asthma_Cases':'sum'
-        }).reset_index()
-        
-        dff['Asthma_Rate'] = dff['Total_Asthma_Cases'] / dff['totalpopulation']
-        
-        fig = px.choropleth(
-            dff, locations='stateabbr', locationmode="USA-states", color='Asthma_Rate',
-            color_continuous_scale="Viridis",
-            range_color=(6, np.max(dff['Asthma_Rate'])),
-            scope="usa",
-            hover_name="statedesc",
-            hover_data=['stateabbr', 'statedesc'],
-            labels={'Asthma_Rate':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+    ### Tract View ###
 
-        return fig
- 
- 
-#####################################################################################################################################################################################################################################
- 
+    if Geo == 'TR':
 
-    ### Scenario 7 ###
-    
-    # View = County
-    # Metric = Monetary Value
-    # State Dropdown = Not None
-    # County Dropdown = None
+        # Every tract is evaluated for the national color range, only the
+        # selected ones are drawn, zoomed in on them
+        rows = tract_regions.rows(State, County)
+        frame = tract_base if Metric == RATES else tract_base.assign(**tract_engine.evaluate(Emissions, Smoking, Healthcare))
+        dff = frame.iloc[rows]
+        geojson = tract_subset(dff['tractfips'])
 
-    if Geo == 'CT' and State is not None and County is None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)':       
+        if Metric == RATES:
+            return choropleth(
+                dff, geojson=geojson, locations='tractfips', color='casthma_adjprev',
+                range_color=(7, np.max(tract_base['casthma_adjprev'])),
+                hover_name="countyname",
+                hover_data={"statedesc"},
+                labels={'casthma_adjprev':'Asthma Rates'},
+                fitbounds="locations")
 
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Monetary_Impact'])),
-            scope="usa",
+        color, hover_data = IMPACT_COLUMNS[Metric]
+        return choropleth(
+            dff, geojson=geojson, locations='tractfips', color=color,
+            range_color=(0, np.max(frame[color])),
             hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig  
- 
- 
-#####################################################################################################################################################################################################################################
-
+            hover_data=["statedesc"] + hover_data,
+            labels={color},
+            fitbounds="locations")
 
-    ### Scenario 8 ###
-    
-    # View = County
-    # Metric = Monetary Value
-    # State Dropdown = Not None
-    # County Dropdown = Not None
-
-    if Geo == 'CT' and State is not None and County is not None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)':       
-        
-        dff = df.loc[df.statedesc.str.contains('|'.join(State)) & df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Monetary_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
 
-        return fig 
-        
-        
-#####################################################################################################################################################################################################################################
-
-
-    ### Scenario 9 ###
-    
-    # View = County
-    # Metric = Monetary Value
-    # State Dropdown = None
-    # County Dropdown = Not None
- 
-    if Geo == 'CT' and County is not None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)':       
-        
-        dff = df.loc[df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Monetary_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig           
-
-
-#####################################################################################################################################################################################################################################
-
-
-    ### Scenario 10 ###
-    
-    # View = County
-    # Metric = Total Cases
-    # State Dropdown = Not None
-    # County Dropdown = Not None
-
-    if Geo == 'CT' and State is not None and County is None and Metric == 'Total Reduced Asthma Cases':       
-        
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig 
-        
-
-#####################################################################################################################################################################################################################################
-
-
-    ### Scenario 11 ###
-    
-    # View = County
-    # Metric = Total Cases
-    # State Dropdown = Not None
-    # County Dropdown = Not None
-
-    if Geo == 'CT' and State is not None and County is not None and Metric == 'Total Reduced Asthma Cases':       
-        
-        dff = df.loc[df.statedesc.str.contains('|'.join(State)) & df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig 
- 
-
-#####################################################################################################################################################################################################################################
-
-
-    ### Scenario 12 ###
-    
-    # View = County
-    # Metric = Total Cases
-    # State Dropdown = None
-    # County Dropdown = Not None
-
-    if Geo == 'CT' and County is not None and Metric == 'Total Reduced Asthma Cases':       
-        
-        dff = df.loc[df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(df['Total_Impact'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data=["statedesc", "Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig 
-
- 
-
-#####################################################################################################################################################################################################################################
-
-
-    ### Scenario 13 ###
-    
-    # View = County
-    # Metric = Asthma Rates
-    # State Dropdown = Not None
-    # County Dropdown = None
-
-    if Geo == 'CT' and State is not None and County is None and Metric == 'Asthma Rates':         
-        
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='casthma_adjprev',
-            color_continuous_scale="Viridis",
-            range_color=(7, np.max(df['casthma_adjprev'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data={"statedesc"},
-            labels={'casthma_adjprev':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig
-        
-        
 #####################################################################################################################################################################################################################################
 
 
-    ### Scenario 14 ###
-    
-    # View = County
-    # Metric = Asthma Rates
-    # State Dropdown = Not None
-    # County Dropdown = None
-
-    if Geo == 'CT' and State is not None and County is not None and Metric == 'Asthma Rates':       
-        
-        dff = df.loc[df.statedesc.str.contains('|'.join(State)) & df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='casthma_adjprev',
-            color_continuous_scale="Viridis",
-            range_color=(7, np.max(df['casthma_adjprev'])),
-            scope="usa",
-            hover_name="countyname",
-            hover_data={"statedesc"},
-            labels={'casthma_adjprev':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig 
+    ### County View ###
 
+    if Geo == 'CT':
 
-#####################################################################################################################################################################################################################################
+        # Per-request county frame, the base dataset is never modified
+        # (asthma rates don't depend on the sliders)
+        base = data.base
+        frame = base if Metric == RATES else base.assign(**data.cube.evaluate(Emissions, Smoking, Healthcare))
+        dff = select_rows(data, frame, State, County)
 
+        # Only send the geometry of the selected counties
+        if dff is frame:
+            geojson = load_counties()
+        else:
+            geojson = county_subset(dff['countyfips'])
 
-    ### Scenario 15 ###
-    
-    # View = County
-    # Metric = Asthma Rates
-    # State Dropdown = None
-    # County Dropdown = Not None
+        if Metric == RATES:
+            return choropleth(
+                dff, geojson=geojson, locations='countyfips', color='casthma_adjprev',
+                range_color=(7, np.max(base['casthma_adjprev'])),
+                hover_name="countyname",
+                hover_data={"statedesc"},
+                labels={'casthma_adjprev':'Asthma Rates'})
 
-    if Geo == 'CT' and County is not None and Metric == 'Asthma Rates':       
-        
-        dff = df.loc[df.countyname.str.contains('|'.join(County))]
-        
-        fig = px.choropleth(
-            dff, geojson=counties, locations='countyfips', color='casthma_adjprev',
-            color_continuous_scale="Viridis",
-            range_color=(7, np.max(df['casthma_adjprev'])),
-            scope="usa",
+        color, hover_data = IMPACT_COLUMNS[Metric]
+        return choropleth(
+            dff, geojson=geojson, locations='countyfips', color=color,
+            range_color=(0, np.max(frame[color])),
             hover_name="countyname",
-            hover_data={"statedesc"},
-            labels={'casthma_adjprev':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig 
+            hover_data=["statedesc"] + hover_data,
+            labels={color})
 
 
 #####################################################################################################################################################################################################################################
 
 
-    ### Scenario 16 ###
-    
-    # View = State
-    # Metric = Monetary Value
-    # State Dropdown = Not None
-    # County Dropdown = None
-
-    if Geo == 'ST' and State is not None and Metric == 'Total Monetary Value of Reduced Asthma Cases ($100,000 USD)':       
+    ### State View ###
 
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))]
+    # The County Dropdown doesn't apply to State aggregates
+    dff = state_results(data, data.regions.rows(State, None), Metric, Emissions, Smoking, Healthcare)
 
-        dfff = dff.groupby(['stateabbr', 'statedesc']).agg({
-        'Reduced_Emissions_Monetary_Impact_State':'sum',
-        'Reduced_Smoking_Monetary_Impact_State':'sum',
-        'Increased_Healthcare_Access_Monetary_Impact_State':'sum',
-        'Total_Monetary_Impact_State':'sum'
-        }).reset_index()
-        
-        # Emissions Impact
-        dfff = dfff.rename(columns={'Reduced_Emissions_Monetary_Impact_State': 'Reduced_Emissions_Monetary_Impact'})
-        dfff['Reduced_Emissions_Monetary_Impact'] = dfff['Reduced_Emissions_Monetary_Impact'].astype(int)
-        dfff['Reduced_Emissions_Monetary_Impact'] = dfff['Reduced_Emissions_Monetary_Impact'] / 100000
-        
-        # Smoking Impact
-        dfff = dfff.rename(columns={'Reduced_Smoking_Monetary_Impact_State': 'Reduced_Smoking_Monetary_Impact'})
-        dfff['Reduced_Smoking_Monetary_Impact'] = dfff['Reduced_Smoking_Monetary_Impact'].astype(int)
-        dfff['Reduced_Smoking_Monetary_Impact'] = dfff['Reduced_Smoking_Monetary_Impact'] / 100000
-        
-        # Healthcare Impact
-        dfff = dfff.rename(columns={'Increased_Healthcare_Access_Monetary_Impact_State': 'Increased_Healthcare_Access_Monetary_Impact'})
-        dfff['Increased_Healthcare_Access_Monetary_Impact'] = dfff['Increased_Healthcare_Access_Monetary_Impact'].astype(int)
-        dfff['Increased_Healthcare_Access_Monetary_Impact'] = dfff['Increased_Healthcare_Access_Monetary_Impact'] / 100000
-        
-        # Total Impact
-        dfff = dfff.rename(columns={'Total_Monetary_Impact_State': 'Total_Monetary_Impact'})
-        dfff['Total_Monetary_Impact'] = dfff['Total_Monetary_Impact'].astype(int)
-        dfff['Total_Monetary_Impact'] = dfff['Total_Monetary_Impact'] / 100000
-        
-        fig = px.choropleth(
-            dfff, locations='stateabbr', locationmode="USA-states", color='Total_Monetary_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(dff['Total_Monetary_Impact'])),
-            scope="usa",
+    if Metric == RATES:
+        return choropleth(
+            dff, locations='stateabbr', locationmode="USA-states", color='Asthma_Rate',
+            range_color=(6, np.max(dff['Asthma_Rate'])),
             hover_name="statedesc",
-            hover_data=["Reduced_Emissions_Monetary_Impact", "Reduced_Smoking_Monetary_Impact", "Increased_Healthcare_Access_Monetary_Impact"],
-            labels={'Total_Monetary_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
-
-        return fig
-
-
-#####################################################################################################################################################################################################################################
+            hover_data=['stateabbr', 'statedesc'],
+            labels={'Asthma_Rate':'Asthma Rates'})
 
+    color, hover_data = IMPACT_COLUMNS[Metric]
+    return choropleth(
+        dff, locations='stateabbr', locationmode="USA-states", color=color,
+        range_color=(0, np.max(dff[color])),
+        hover_name="statedesc",
+        hover_data=hover_data,
+        labels={color})
+
+
+## Figure Cache ##
+
+FIGURE_CACHE_BYTES = int(os.environ.get('ASTHMA_FIGURE_CACHE_BYTES', 64 * 2**20))
+# SQLite file shared by the worker processes of a server (gunicorn.conf.py),
+# kept in process memory when unset
+FIGURE_CACHE_PATH = os.environ.get('ASTHMA_FIGURE_CACHE_PATH')
+
+
+def figure_geometry(key, figure):
+    # Geometry of a figure read back from the shared cache, the State view
+    # has none and the County view the whole county geometry when unfiltered
+    Geo, State, County = key[:3]
+    locations = figure['data'][0]['locations']
+    if Geo == 'TR':
+        return tract_subset(locations)
+    if Geo == 'CT':
+        return load_counties() if not State and not County else county_subset(locations)
+    return None
+
+
+# Rendered figures keyed on the quantized dashboard state
+if FIGURE_CACHE_PATH:
+    # Figures cached by an earlier run on other data or another model are dropped
+    figure_cache = SharedFigureCache(FIGURE_CACHE_PATH, FIGURE_CACHE_BYTES, geometry=figure_geometry, version=json.dumps(
+        [fixed_model['data_hash'], fixed_model['params'], DEFAULT_LEVEL, TRACTS], sort_keys=True))
+else:
+    figure_cache = FigureCache(FIGURE_CACHE_BYTES)
+
+
+def figure_key(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year=None):
+    # Asthma rates don't depend on the sliders
+    sliders = None
+    if Metric != RATES:
+        sliders = tuple(quantize(value) for value in (Emissions, Smoking, Healthcare))
+        if None in sliders:
+            return None
+    # A year's figures are dropped when its data is rebuilt
+    data = year_data(Year)
+    return (view_level(Geo, State, County), tuple(sorted(State or ())), tuple(sorted(County or ())), Metric, sliders,
+            data.year, data.version)
+
+
+def cached_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year=None):
+    key = figure_key(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
+    figure = None if key is None else figure_cache.get(key)
+    if figure is None:
+        figure = display_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
+        if key is not None:
+            figure_cache.put(key, figure)
+    return figure
+
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return figure_cache.stats()
+
+
+## Confidence Intervals ##
+
+# Counties or States listed with intervals of their own, those with the most
+# reduced cases
+INTERVAL_REGIONS = 10
+
+
+def interval_text(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year=None):
+    # Bootstrap interval of the total of the counties or States on the map,
+    # and of the counties or States with the most reduced cases
+    if Metric == RATES:
+        return ''
+    data = year_data(Year)
+    samples = data.current_draws()
+    if samples is None:
+        return 'Confidence interval: not available until {} has run'.format(data.bootstrap_command)
+
+    def value(cases):
+        # Apply monetary societal benefit
+        return (cases * ASTHMA_COST) / MONETARY_UNIT if Metric == MONETARY else cases
+
+    # The County Dropdown doesn't apply to State aggregates
+    rows = data.regions.rows(State, None if Geo == 'ST' else County)
+    totals = bootstrap.total_draws(data.engine, samples, Emissions, Smoking, Healthcare, rows)
+    lower, upper = bootstrap.interval(totals.sum(axis=1))
+    total = '{:.0%} bootstrap interval of the total shown: {:,.1f} to {:,.1f} ({:,} resampled model fits)'.format(
+        bootstrap.LEVEL, value(lower), value(upper), len(samples))
+
+    cases = data.engine.impacts(Emissions, Smoking, Healthcare).sum(axis=0)
+    if Geo == 'ST':
+        states, (cases,) = data.rollup.sum(cases[None], rows)
+        top = np.argsort(-cases, kind='stable')[:INTERVAL_REGIONS]
+        names = data.rollup.statedesc[states[top]]
+        codes = data.rollup.codes if rows is None else data.rollup.codes[rows]
+        bounds = bootstrap.impact_intervals(totals, codes)[:, top]
+    else:
+        frame = data.base if rows is None else data.base.iloc[rows]
+        cases = cases if rows is None else cases[rows]
+        top = np.argsort(-cases, kind='stable')[:INTERVAL_REGIONS]
+        names = (frame['countyname'] + ', ' + frame['stateabbr']).to_numpy()[top]
+        # Only the listed counties' percentiles
+        bounds = bootstrap.impact_intervals(totals[:, top])
+    table = html.Table(
+        [html.Tr([html.Th(heading) for heading in ['State' if Geo == 'ST' else 'County', 'Estimate', 'Lower', 'Upper']])]
+        + [html.Tr([html.Td(name)] + [html.Td('{:,.1f}'.format(value(bound))) for bound in (estimate, lower, upper)])
+           for name, estimate, lower, upper in zip(names, cases[top], *bounds)])
+    return [html.Div(total), html.Details([
+        html.Summary('{:.0%} bootstrap intervals of the {} with the most reduced cases'.format(
+            bootstrap.LEVEL, 'States' if Geo == 'ST' else 'counties')),
+        table])]
+
+
+## Batch Scenario API ##
+
+# Scenarios per request, and per vectorized chunk of the streamed response
+MAX_SCENARIOS = 100000
+SCENARIO_CHUNK = 256
+# Percentage points a factor of a scenario can be reduced by
+SCENARIO_RANGE = (0, 100)
+# Reduced cases and monetary values ($100,000 USD) returned for every scenario
+BATCH_COLUMNS = CASE_COLUMNS + IMPACT_COLUMNS[MONETARY][1] + [IMPACT_COLUMNS[MONETARY][0]]
+
+
+def parse_batch(body):
+    # Validate a batch request, raising ValueError with the reason
+    if not isinstance(body, dict):
+        raise ValueError('Expected a JSON object')
+    level = body.get('level', 'county')
+    if level not in ('county', 'state'):
+        raise ValueError("level must be 'county' or 'state'")
+    try:
+        scenarios = np.array(body.get('scenarios'), dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError('scenarios must be a list of [emissions, smoking, healthcare] percentages')
+    if scenarios.ndim != 2 or scenarios.shape[1] != 3 or not np.all(np.isfinite(scenarios)):
+        raise ValueError('scenarios must be a list of [emissions, smoking, healthcare] percentages')
+    if np.any(scenarios < SCENARIO_RANGE[0]) or np.any(scenarios > SCENARIO_RANGE[1]):
+        raise ValueError('scenarios must be percentages from {} to {}'.format(*SCENARIO_RANGE))
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError('At most {:,} scenarios per request'.format(MAX_SCENARIOS))
+    State, County, columns = body.get('states'), body.get('counties'), body.get('columns')
+    for name, values in (('states', State), ('counties', County), ('columns', columns)):
+        if values is not None and not (isinstance(values, list) and all(isinstance(value, str) for value in values)):
+            raise ValueError('{} must be a list of strings'.format(name))
+    # Like states and counties, null columns select them all
+    if columns is None:
+        columns = BATCH_COLUMNS
+    unknown = sorted(set(columns) - set(BATCH_COLUMNS))
+    if unknown:
+        raise ValueError('Unknown columns {}, expected some of {}'.format(unknown, BATCH_COLUMNS))
+    Year = body.get('year', BASE_YEAR)
+    # 2019.0 == 2019, only accept the integers
+    if not isinstance(Year, int) or isinstance(Year, bool) or Year not in YEARS:
+        raise ValueError('year must be one of {}'.format(YEARS))
+    return scenarios, level, State, County, columns, Year
+
+
+def batch_results(data, scenarios, level, selected, columns=BATCH_COLUMNS):
+    # Impact columns of every scenario, a vectorized chunk of scenarios at a
+    # time; selected are the State positions or county rows (None for all)
+    for start in range(0, len(scenarios), SCENARIO_CHUNK):
+        chunk = scenarios[start:start + SCENARIO_CHUNK]
+        if level == 'state':
+            impacts = data.cube.scenario_state_impacts(chunk)[:, :, selected]
+        else:
+            impacts = data.cube.scenario_impacts(chunk, selected)
+        # impact_columns takes the factors first
+        values = impact_columns(impacts.transpose(1, 0, 2))
+        for i, scenario in enumerate(chunk):
+            result = {'scenario': scenario.tolist()}
+            for column in columns:
+                result[column] = values[column][i].tolist()
+            yield result
+
+
+@app.server.route('/scenarios', methods=['POST'])
+def batch_scenarios():
+    """Evaluate a batch of slider scenarios.
+
+    Takes {"scenarios": [[emissions, smoking, healthcare], ...], "level":
+    "county" or "state", "states": [...], "counties": [FIPS, ...],
+    "columns": [...], "year": year} and streams {"level", "year", "ids",
+    "names", "columns", "results": [{"scenario", <column>: [value per id]},
+    ...]}.
+    """
+    try:
+        scenarios, level, State, County, columns, Year = parse_batch(flask.request.get_json(silent=True))
+    except ValueError as error:
+        return {'error': str(error)}, 400
+
+    data = year_data(Year)
+    if level == 'state':
+        # The County filter doesn't apply to State aggregates
+        selected = data.rollup.present(data.regions.rows(State, None))
+        ids, names = data.rollup.stateabbr[selected], data.rollup.statedesc[selected]
+    else:
+        selected = data.regions.rows(State, County)
+        frame = data.base if selected is None else data.base.iloc[selected]
+        ids, names = frame['countyfips'], frame['countyname'] + ', ' + frame['stateabbr']
+    header = {'level': level, 'year': Year, 'ids': list(ids), 'names': list(names), 'columns': columns}
 
-    ### Scenario 17 ###
-    
-    # View = State
-    # Metric = Total Cases
-    # State Dropdown = Not None
-    # County Dropdown = None
+    def stream():
+        # Results are written as they are computed, large batches never sit in memory
+        yield json.dumps(header)[:-1] + ', "results": ['
+        for i, result in enumerate(batch_results(data, scenarios, level, selected, columns)):
+            yield (', ' if i else '') + json.dumps(result)
+        yield ']}'
 
-    if Geo == 'ST' and State is not None and Metric == 'Total Reduced Asthma Cases':       
+    return flask.Response(stream(), mimetype='application/json')
 
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))]
 
-        dfff = dff.groupby(['stateabbr', 'statedesc']).agg({
-        'Reduced_Emissions_Impact':'sum',
-        'Reduced_Smoking_Impact':'sum',
-        'Increased_Healthcare_Access_Impact':'sum',
-        'Total_Impact':'sum'
-        }).reset_index()
-        
-        fig = px.choropleth(
-            dfff, locations='stateabbr', locationmode="USA-states", color='Total_Impact',
-            color_continuous_scale="Viridis",
-            range_color=(0, np.max(dff['Total_Impact'])),
-            scope="usa",
-            hover_name="statedesc",
-            hover_data=["Reduced_Emissions_Impact", "Reduced_Smoking_Impact", "Increased_Healthcare_Access_Impact"],
-            labels={'Total_Impact'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+## Policy Optimizer ##
 
-        return fig
+# Columns of the optimized allocation, in the order of the sliders
+ALLOCATION_COLUMNS = ['Emissions_Reduction', 'Smoking_Reduction', 'Healthcare_Access_Increase']
 
 
-#####################################################################################################################################################################################################################################
+def optimize(data, selected, costs, budget, per_state=False):
+    # The allocation of the selected States (positions of the rollup) as a
+    # frame with its cost and monetary impacts; exact for budgets of every
+    # State, greedy (approximate) for a total budget
+    values = data.cube.state_cube[:, :, selected]
+    costs = optimizer.state_costs(costs, len(selected))
+    if per_state:
+        steps = optimizer.allocate_state_budgets(values, costs, budget)
+    else:
+        steps = optimizer.allocate_budget(values, costs, budget)
+    cases = np.stack([values[factor, steps[:, factor], np.arange(len(selected))] for factor in range(3)])
+
+    dff = pd.DataFrame({'stateabbr': data.rollup.stateabbr[selected], 'statedesc': data.rollup.statedesc[selected]})
+    for factor, column in enumerate(ALLOCATION_COLUMNS):
+        dff[column] = steps[:, factor] * optimizer.STEP
+    dff['Cost'] = optimizer.allocation_cost(costs, steps)
+    columns = impact_columns(cases)
+    for column in CASE_COLUMNS + IMPACT_COLUMNS[MONETARY][1] + [IMPACT_COLUMNS[MONETARY][0]]:
+        dff[column] = columns[column]
+    return dff
+
+
+def optimizer_choropleth(dff):
+    color = IMPACT_COLUMNS[MONETARY][0]
+    return choropleth(
+        dff, locations='stateabbr', locationmode="USA-states", color=color,
+        range_color=(0, dff[color].to_numpy().max(initial=1)),
+        hover_name="statedesc",
+        hover_data=ALLOCATION_COLUMNS + ['Cost'],
+        labels={color})
+
+
+def optimizer_summary(dff, budget, per_state):
+    return '{}: {:,.1f} ($100,000 USD) of reduced asthma cases ({:,} cases) for {:,.0f} USD, within {} {:,.0f} USD{}'.format(
+        'Best allocation of every State' if per_state else 'Greedy (approximate) allocation',
+        dff[IMPACT_COLUMNS[MONETARY][0]].sum(), dff['Total_Impact'].sum(), dff['Cost'].sum(),
+        'budgets of' if per_state else 'a budget of', budget, ' per State' if per_state else '')
+
+
+def parse_optimize(body, names):
+    # Validate an optimizer request for the States of names, raising
+    # ValueError with the reason; per State values are keyed by State name
+    def per_state_values(value, name, shape):
+        if isinstance(value, dict) and shape:
+            missing = sorted(set(names) - set(value))
+            if missing:
+                raise ValueError('{} has no value for {}'.format(name, missing))
+            value = [value[state] for state in names]
+        try:
+            value = np.broadcast_to(np.array(value, dtype=np.float64), shape)
+        except (TypeError, ValueError):
+            raise ValueError('{} must be {}{}'.format(
+                name, 'a list of [emissions, smoking, healthcare] costs' if shape[-1:] == (3,) else 'a number',
+                ', or a dict of them by State' if shape else ''))
+        if not np.all(np.isfinite(value)) or np.any(value < 0):
+            raise ValueError('{} must not be negative'.format(name))
+        return value
+
+    if ('budget' in body) == ('budgets' in body):
+        raise ValueError("Give either a total 'budget' or the 'budgets' of every State")
+    costs = per_state_values(body.get('costs', OPTIMIZER_COSTS), 'costs', (len(names), 3))
+    if 'budget' in body:
+        return costs, float(per_state_values(body['budget'], 'budget', ())), False
+    return costs, per_state_values(body['budgets'], 'budgets', (len(names),)), True
+
+
+@app.server.route('/optimize', methods=['POST'])
+def optimize_allocation():
+    """Find the allocation of slider improvements across States within a budget.
+
+    Takes {"costs": [emissions, smoking, healthcare] USD per percentage point
+    (or a dict of them by State name), "budget": total USD or "budgets": USD
+    of every State (or a dict by State name), "states": [...], "year": year}
+    and returns the allocation, cost and impacts of every State.
+    """
+    body = flask.request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return {'error': 'Expected a JSON object'}, 400
+    Year = body.get('year', BASE_YEAR)
+    if not isinstance(Year, int) or isinstance(Year, bool) or Year not in YEARS:
+        return {'error': 'year must be one of {}'.format(YEARS)}, 400
+    State = body.get('states')
+    if State is not None and not (isinstance(State, list) and all(isinstance(value, str) for value in State)):
+        return {'error': 'states must be a list of strings'}, 400
+
+    data = year_data(Year)
+    selected = data.rollup.present(data.regions.rows(State, None))
+    try:
+        costs, budget, per_state = parse_optimize(body, list(data.rollup.statedesc[selected]))
+    except ValueError as error:
+        return {'error': str(error)}, 400
+
+    dff = optimize(data, selected, costs, budget, per_state)
+    result = {'year': Year, 'columns': list(dff.columns)}
+    result.update({column: dff[column].tolist() for column in dff.columns})
+    result['total'] = {column: dff[column].sum().item() for column in ['Cost'] + CASE_COLUMNS[-1:] + [IMPACT_COLUMNS[MONETARY][0]]}
+    return result
+
+
+def slider_patch(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year=None):
+    # Partial figure update when only the sliders moved: the geometry, layout
+    # and locations stay, only the colors, hover values and color range change
+    if Metric == RATES:
+        return dash.no_update
+
+    color, hover_data = IMPACT_COLUMNS[Metric]
+    Geo = view_level(Geo, State, County)
+    data = year_data(Year)
+
+    if Geo in ('CT', 'TR'):
+        if Geo == 'CT':
+            results, frame, rows = data.cube.evaluate(Emissions, Smoking, Healthcare), data.base, data.regions.rows(State, County)
+        else:
+            results, frame, rows = tract_engine.evaluate(Emissions, Smoking, Healthcare), tract_base, tract_regions.rows(State, County)
+        columns = [frame['statedesc'].to_numpy()] + [results[column] for column in hover_data] + [results[color]]
+        if rows is not None:
+            columns = [values[rows] for values in columns]
+        z = columns[-1]
+        customdata = np.column_stack(columns[:-1])
+        cmax = np.max(results[color])
+    else:
+        dff = state_results(data, data.regions.rows(State, None), Metric, Emissions, Smoking, Healthcare)
+        z = dff[color].to_numpy()
+        customdata = dff[hover_data].to_numpy()
+        cmax = np.max(z)
 
+    patched = dash.Patch()
+    patched['data'][0]['z'] = z
+    patched['data'][0]['customdata'] = customdata
+    patched['layout']['coloraxis']['cmax'] = cmax
+    return patched
 
-    ### Scenario 18 ###
-    
-    # View = State
-    # Metric = Asthma Rates
-    # State Dropdown = Not None
-    # County Dropdown = None
 
-    if Geo == 'ST' and State is not None and Metric == 'Asthma Rates':       
+def current_view(Geo, State, County, Metric, Year=None):
+    # Rows (County view) or States (State view) shown by the figure, in figure order
+    data = year_data(Year)
+    if Geo == 'CT':
+        rows = data.regions.rows(State, County)
+        return {'geo': Geo, 'metric': Metric, 'rows': None if rows is None else rows.tolist()}
+    return {'geo': Geo, 'metric': Metric, 'states': data.rollup.present(data.regions.rows(State, None)).tolist()}
 
-        dff = df.loc[df.statedesc.str.contains('|'.join(State))] 
 
-        dff['Total_Asthma_Cases'] = dff['totalpopulation'] * dff['casthma_adjprev']
-        
-        dfff = dff.groupby(['stateabbr', 'statedesc']).agg({
-        'totalpopulation':'sum',
-        'Total_Asthma_Cases':'sum'
-        }).reset_index()
-        
-        dfff['Asthma_Rate'] = dfff['Total_Asthma_Cases'] / dfff['totalpopulation']
-        
-        fig = px.choropleth(
-            dfff, locations='stateabbr', locationmode="USA-states", color='Asthma_Rate',
-            color_continuous_scale="Viridis",
-            range_color=(6, np.max(dfff['Asthma_Rate'])),
-            scope="usa",
-            hover_name='statedesc',
-            labels={'Asthma_Rate':'Asthma Rates'})
-        fig.update_layout(
-            height=500, width = 1300, margin={"r":0,"t":0,"l":0,"b":0})
+map_inputs = [
+    dash.dependencies.Input("geo-level", "value"),
+    dash.dependencies.Input("state-filter", "value"),
+    dash.dependencies.Input("county-filter", "value"),
+    dash.dependencies.Input("metric-selected", "value")]
+slider_ids = ["emissions-slider", "smoking-slider", "healthcare-slider"]
+year_input = dash.dependencies.Input("year-selected", "value")
+
+if CLIENTSIDE:
+
+    # Server only redraws the map when geography, filters, metric or year
+    # change; the year's scenario terms are sent along with a new year
+    @app.callback(
+        [dash.dependencies.Output("choropleth", "figure"),
+        dash.dependencies.Output("view-store", "data"),
+        dash.dependencies.Output("scenario-store", "data")],
+        map_inputs + [year_input],
+        [dash.dependencies.State(slider, "value") for slider in slider_ids])
+    def display_view(Geo, State, County, Metric, Year, Emissions, Smoking, Healthcare):
+        triggered = {trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered}
+        terms = scenario_terms(year_data(Year)) if 'year-selected' in triggered else dash.no_update
+        return (cached_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year),
+                current_view(Geo, State, County, Metric, Year), terms)
+
+    # Slider changes are recomputed in the browser (assets/scenario.js)
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='asthma', function_name='update_scenario'),
+        dash.dependencies.Output("choropleth", "figure", allow_duplicate=True),
+        [dash.dependencies.Input(slider, "value") for slider in slider_ids] +
+        [dash.dependencies.Input("view-store", "data")],
+        [dash.dependencies.State("choropleth", "figure"),
+        dash.dependencies.State("scenario-store", "data")],
+        prevent_initial_call=True)
+
+else:
+
+    @app.callback(
+        dash.dependencies.Output("choropleth", "figure"),
+        map_inputs + [dash.dependencies.Input(slider, "value") for slider in slider_ids] + [year_input])
+    def update_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year):
+        # Only redraw the whole map when more than the sliders changed
+        triggered = {trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered}
+        if triggered <= set(slider_ids):
+            return slider_patch(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
+        return cached_choropleth(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
+
+# Intervals are computed in their own callback, the map never waits for them
+if CLIENTSIDE:
+
+    # Slider changes never reach the server, the intervals follow the view
+    # and are recomputed for the current sliders on request
+    @app.callback(
+        dash.dependencies.Output('interval-container', 'children'),
+        map_inputs + [year_input, dash.dependencies.Input('interval-button', 'n_clicks')],
+        [dash.dependencies.State(slider, "value") for slider in slider_ids])
+    def update_interval(Geo, State, County, Metric, Year, n_clicks, Emissions, Smoking, Healthcare):
+        return interval_text(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
+
+    # Until then the browser marks the intervals shown as outdated
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='asthma', function_name='outdated_interval'),
+        dash.dependencies.Output('interval-container', 'children', allow_duplicate=True),
+        [dash.dependencies.Input(slider, "value") for slider in slider_ids],
+        [dash.dependencies.State("view-store", "data"),
+        dash.dependencies.State("scenario-store", "data")],
+        prevent_initial_call=True)
+
+else:
+
+    @app.callback(
+        dash.dependencies.Output('interval-container', 'children'),
+        map_inputs + [dash.dependencies.Input(slider, "value") for slider in slider_ids] + [year_input])
+    def update_interval(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year):
+        return interval_text(Geo, State, County, Metric, Emissions, Smoking, Healthcare, Year)
 
-        return fig
+@app.callback(
+    [dash.dependencies.Output('optimizer-map', 'figure'),
+    dash.dependencies.Output('optimizer-map', 'style'),
+    dash.dependencies.Output('optimizer-summary', 'children')],
+    [dash.dependencies.Input('optimize-button', 'n_clicks')],
+    [dash.dependencies.State(field, 'value') for field in
+        ['emissions-cost', 'smoking-cost', 'healthcare-cost', 'budget-mode', 'budget', 'state-filter', 'year-selected']],
+    prevent_initial_call=True)
+def update_optimizer(n_clicks, EmissionsCost, SmokingCost, HealthcareCost, Mode, Budget, State, Year):
+    costs = [EmissionsCost, SmokingCost, HealthcareCost]
+    if any(value is None or value < 0 for value in costs + [Budget]):
+        return dash.no_update, dash.no_update, 'Enter the costs and the budget as non-negative numbers'
+    data = year_data(Year)
+    selected = data.rollup.present(data.regions.rows(State, None))
+    if len(selected) == 0:
+        return dash.no_update, {'display': 'none'}, 'None of the selected States has data for {}'.format(data.year)
+    dff = optimize(data, selected, costs, Budget, Mode == 'state')
+    return optimizer_choropleth(dff), {'display': 'block'}, optimizer_summary(dff, Budget, Mode == 'state')
+
+startup.phase('layout build')
+
+# Multi-worker serving (gunicorn.conf.py) imports the app once in the parent
+# process before forking the workers. Loading the geometry and rendering
+# every view there first leaves the workers sharing those pages, and the
+# lazily imported plotly modules, instead of each building its own copy;
+# frozen objects are never written to by the garbage collector of a worker.
+if os.environ.get('ASTHMA_PRELOAD', '0') == '1':
+    from plotly.io.json import to_json_plotly
+    county_index()
+    for Geo in ('CT', 'ST'):
+        for Metric in (MONETARY, RATES):
+            to_json_plotly(display_choropleth(Geo, None, None, Metric, 0, 0, 0))
+    gc.collect()
+    gc.freeze()
+    startup.phase('preload')
+
+startup.report()
 
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
\ No newline at end of file
+    app.run(debug=True, threaded=True)
\ No newline at end of file
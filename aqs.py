@@ -0,0 +1,150 @@
+"""Concurrent EPA AQS fetcher for Data/Emissions.csv.
+
+Replaces the serial request loop of "Capstone - Emissions Data.ipynb".  The
+per-State ``annualData/byState`` calls run on a bounded thread pool over one
+pooled session with timeouts, retries and exponential backoff.  Every
+response is cached in Data/aqs keyed by (state, params, bdate, edate), so a
+refresh only requests the States that aren't cached yet.
+
+The pollutants added by ASTHMA_POLLUTANTS (see pollutants.py) are requested
+up to five parameter codes per call, the most the API takes, in their own
+calls next to the PM calls so adding pollutants keeps the cached PM
+responses, and all calls share the pool.
+
+Fetch the emissions data for the States of Data/Income.csv with:
+
+    AQS_EMAIL=... AQS_KEY=... python aqs.py
+
+or the emissions of another year into its sources in Data/years/<year>:
+
+    AQS_EMAIL=... AQS_KEY=... python aqs.py 2020
+
+``AQS_URL`` points the fetcher at another server, such as a local stand-in
+serving recorded responses.
+"""
+import concurrent.futures
+import getpass
+import json
+import os
+import sys
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import pipeline
+from pollutants import POLLUTANTS
+
+AQS_URL = os.environ.get('AQS_URL', 'https://aqs.epa.gov/data/api')
+CACHE_DIR = os.path.join('Data', 'aqs')
+
+# PM2.5, PM10-2.5 and PM10 annual summaries, of the pipeline's base year
+# unless another year is given
+PARAMS = '88101,86101,85101'
+# Parameter codes the API takes in one request
+MAX_PARAMS = 5
+BDATE = '{}0101'.format(pipeline.BASE_YEAR)
+EDATE = '{}1231'.format(pipeline.BASE_YEAR)
+
+# Concurrent requests, seconds to wait for a response and retries per request
+WORKERS = 4
+TIMEOUT = 60
+RETRIES = 5
+
+# Header statuses of a valid response, with or without data
+STATUSES = ('Success', 'No data matched your selection')
+
+
+class AQSError(Exception):
+    """The AQS API answered a request with an error status."""
+
+
+def session(workers=WORKERS, retries=RETRIES):
+    """Return a requests session pooling up to ``workers`` connections.
+
+    Connection errors, throttling and server errors are retried with
+    exponential backoff, honouring Retry-After.
+    """
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    http = requests.Session()
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    return http
+
+
+def cache_path(state, params=PARAMS, bdate=BDATE, edate=EDATE, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, 'byState_{}_{}_{}_{}.json'.format(state, params.replace(',', '-'), bdate, edate))
+
+
+def fetch_state(http, state, email, key, params=PARAMS, bdate=BDATE, edate=EDATE,
+                base_url=AQS_URL, cache_dir=CACHE_DIR, timeout=TIMEOUT):
+    """Return the annual data response of a State, from the cache when possible."""
+    path = cache_path(state, params, bdate, edate, cache_dir)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    response = http.get(base_url + '/annualData/byState', timeout=timeout, params={
+        'email': email, 'key': key, 'param': params, 'bdate': bdate, 'edate': edate, 'state': state})
+    response.raise_for_status()
+    data = response.json()
+    header = data['Header'][0]
+    if header['status'] not in STATUSES:
+        error = header.get('error') or header['status']
+        raise AQSError('State {}: {}'.format(state, '; '.join(error) if isinstance(error, list) else error))
+
+    # Write to a temporary file first so a reader never sees a partial response
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+    return data
+
+
+def param_groups(pollutants=POLLUTANTS, params=PARAMS):
+    """Return PARAMS and the other pollutants' codes in groups of up to MAX_PARAMS."""
+    codes = [pollutant.code for pollutant in pollutants if pollutant.code not in params.split(',')]
+    return [params] + [','.join(codes[start:start + MAX_PARAMS]) for start in range(0, len(codes), MAX_PARAMS)]
+
+
+def fetch(states, email, key, workers=WORKERS, groups=(PARAMS,), **kwargs):
+    """Return the responses of every params group and State, by group then in the order of ``states``."""
+    with session(workers) as http, concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(fetch_state, http, state, email, key, params, **kwargs)
+                   for params in groups for state in states]
+        return [future.result() for future in futures]
+
+
+def state_codes(income_path=pipeline.INCOME_DATA):
+    """Return the State codes of the income data, in order of first appearance."""
+    income = pipeline.normalize_income(pipeline.read_income(income_path), pipeline.BASE_YEAR)
+    return list(income['GeoFips'].str[:2].unique())
+
+
+def emissions_path(year):
+    # Data/Emissions.csv for the base year, the year's sources for the others
+    return pipeline.EMISSIONS_DATA if year == pipeline.BASE_YEAR else pipeline.year_emissions(year)
+
+
+def build(email, key, year=pipeline.BASE_YEAR, output=None, **kwargs):
+    """Fetch the emissions data of every State and pollutant for a year and write it to output."""
+    if output is None:
+        output = emissions_path(year)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    emissions = pd.json_normalize(fetch(state_codes(), email, key, groups=param_groups(), bdate='{}0101'.format(year),
+                                        edate='{}1231'.format(year), **kwargs), record_path=['Data'])
+    emissions.to_csv(output, index=False)
+    return emissions
+
+
+if __name__ == '__main__':
+    email = os.environ.get('AQS_EMAIL') or getpass.getpass('Email:')
+    key = os.environ.get('AQS_KEY') or getpass.getpass('API:')
+    year = int(sys.argv[1]) if len(sys.argv) > 1 else pipeline.BASE_YEAR
+    emissions = build(email, key, year)
+    print('{}: {:,} rows'.format(emissions_path(year), len(emissions)))
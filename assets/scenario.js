@@ -0,0 +1,87 @@
+// Clientside callbacks for the Asthma Societal Impact Dashboard.
+//
+// The scenario math mirrors scenario.py term for term so the browser gives
+// the same reduced case counts (Math.trunc matches astype(int)) and monetary
+// values as the server.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    asthma: {
+
+        // Slider labels
+        percentage_label: function(value) {
+            return 'Percentage Impact = "' + value.toFixed(1) + '%"';
+        },
+
+        // The server computes the intervals of new slider values on request
+        outdated_interval: function(emissions, smoking, healthcare, view, store) {
+            if (!view || !store || view.metric === store.rates) {
+                return window.dash_clientside.no_update;
+            }
+            return 'Confidence intervals: press Update intervals for the current sliders';
+        },
+
+        // Recompute the impacts of the current view when a slider moves
+        update_scenario: function(emissions, smoking, healthcare, view, figure, store) {
+            if (!view || !figure || !store || view.metric === store.rates) {
+                return window.dash_clientside.no_update;
+            }
+
+            const g = store.net_growth;
+            const c = store.asthma_rate;
+            const codes = store.state_codes;
+            const n = g.length;
+            const sliders = [emissions, smoking, healthcare];
+
+            // Reduced cases by factor and in total, per county
+            const impacts = [new Array(n), new Array(n), new Array(n), new Array(n).fill(0)];
+            for (let f = 0; f < 3; f++) {
+                const shift = store.coefs[f] * sliders[f];
+                for (let i = 0; i < n; i++) {
+                    const cases = Math.trunc((g[i] * (c[i] / 100)) - (g[i] * ((c[i] - shift) / 100)));
+                    impacts[f][i] = cases;
+                    impacts[3][i] += cases;
+                }
+            }
+
+            // Apply monetary societal benefit
+            const monetary = view.metric === store.monetary;
+            const value = function(cases) {
+                return monetary ? (cases * store.asthma_cost) / store.monetary_unit : cases;
+            };
+
+            let z, customdata, cmax;
+            if (view.geo === 'CT') {
+                const rows = view.rows || Array.from({length: n}, function(_, i) { return i; });
+                z = rows.map(function(i) { return value(impacts[3][i]); });
+                customdata = rows.map(function(i) {
+                    return [store.state_names[codes[i]], value(impacts[0][i]), value(impacts[1][i]), value(impacts[2][i])];
+                });
+                // Color range covers every county, as on the server
+                cmax = 0;
+                for (let i = 0; i < n; i++) {
+                    cmax = Math.max(cmax, value(impacts[3][i]));
+                }
+            } else {
+                // State aggregation of the reduced cases
+                const sums = [0, 1, 2, 3].map(function() { return new Array(store.state_names.length).fill(0); });
+                for (let f = 0; f < 4; f++) {
+                    for (let i = 0; i < n; i++) {
+                        sums[f][codes[i]] += impacts[f][i];
+                    }
+                }
+                z = view.states.map(function(s) { return value(sums[3][s]); });
+                customdata = view.states.map(function(s) {
+                    return [value(sums[0][s]), value(sums[1][s]), value(sums[2][s])];
+                });
+                cmax = Math.max.apply(null, z);
+            }
+
+            const trace = Object.assign({}, figure.data[0], {z: z, customdata: customdata});
+            const coloraxis = Object.assign({}, figure.layout.coloraxis, {cmin: 0, cmax: cmax});
+            return Object.assign({}, figure, {
+                data: [trace].concat(figure.data.slice(1)),
+                layout: Object.assign({}, figure.layout, {coloraxis: coloraxis})
+            });
+        }
+    }
+});
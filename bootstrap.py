@@ -0,0 +1,171 @@
+"""Bootstrap confidence intervals for the reduced asthma cases.
+
+The fixed effects model is refit on resampled counties, drawn with
+replacement within every State so each State keeps its fixed effect, and the
+dashboard coefficients of every refit are kept as draws.  Resamples are fit
+in batches of stacked least squares solves (fixed_effects.fit_batch) spread
+over a process pool.  The draws are cached in Data/bootstrap.json together
+with a content hash of the data they were drawn from, like the model
+artifact, and turn into intervals of the reduced cases and monetary values
+of any scenario.
+
+Draw them as a build step, the dashboard shows no intervals until they
+exist:
+
+    python bootstrap.py
+    python bootstrap.py tracts
+    python bootstrap.py year 2020
+"""
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import fixed_effects
+from model import (MASTER_DATA, FORMULA, DEPENDENT, GROUPS, REGRESSORS, STATE_EMISSIONS, CSMOKING_ADJPREV,
+                   ACCESS2_ADJPREV, file_hash, model_data, save_model, read_model)
+
+BOOTSTRAP_ARTIFACT = os.path.join('Data', 'bootstrap.json')
+TRACT_BOOTSTRAP_ARTIFACT = os.path.join('Data', 'bootstrap_tract.json')
+# Draws of a year partition, in the year's directory
+YEAR_BOOTSTRAP_ARTIFACT = 'bootstrap.json'
+
+# Resampled fits, fits per stacked solve and processes fitting them, at
+# most four unless BOOTSTRAP_WORKERS says otherwise
+DRAWS = 1000
+BATCH = 50
+WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS', min(4, os.cpu_count() or 1)))
+SEED = 2019
+
+# Coverage of the percentile intervals
+LEVEL = 0.95
+# Draws evaluated at once when turning draws into intervals
+CHUNK = 50
+
+# Dashboard coefficients, in the order of model.coefficients(); the
+# regressors are the last params of a fit
+COEFFICIENTS = (STATE_EMISSIONS, CSMOKING_ADJPREV, ACCESS2_ADJPREV)
+PARAMS = [list(REGRESSORS).index(name) - len(REGRESSORS) for name in COEFFICIENTS]
+
+
+def resample_weights(codes, size, rng):
+    """Return (size, rows) counts of rows drawn with replacement within every group."""
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # Every position of the rows sorted by group draws a row of its group
+    group = codes[order]
+    rows = order[starts[group] + (rng.random((size, len(codes))) * counts[group]).astype(np.intp)]
+    flat = (np.arange(size)[:, None] * len(codes) + rows).ravel()
+    return np.bincount(flat, minlength=size * len(codes)).reshape(size, len(codes))
+
+
+def draw_batch(y, X, groups, size, seed):
+    """Return the dashboard coefficients of size resampled fits (run by the pool)."""
+    codes = pd.factorize(groups, sort=True)[0]
+    weights = resample_weights(codes, size, np.random.default_rng(seed))
+    return fixed_effects.fit_batch(y, X, groups, weights)[:, PARAMS]
+
+
+def draw(df, draws=DRAWS, batch=BATCH, workers=WORKERS, seed=SEED):
+    """Return a (draws, 3) array of bootstrap draws of the dashboard coefficients.
+
+    Every batch has its own seed spawned from ``seed``, so the draws don't
+    depend on the number of workers.
+    """
+    data = model_data(df)
+    y = data[DEPENDENT].to_numpy()
+    X = data[list(REGRESSORS)].to_numpy()
+    groups = data[GROUPS].to_numpy()
+    sizes = [min(batch, draws - start) for start in range(0, draws, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers == 1:
+        return np.concatenate([draw_batch(y, X, groups, size, s) for size, s in zip(sizes, seeds)])
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(draw_batch, y, X, groups, size, s) for size, s in zip(sizes, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+def read_draws(data_path=MASTER_DATA, artifact_path=BOOTSTRAP_ARTIFACT):
+    """Return the cached draws if they were drawn from the current data, else None."""
+    artifact = read_model(artifact_path)
+    if artifact is None or artifact.get('formula') != FORMULA or artifact.get('data_hash') != file_hash(data_path):
+        return None
+    return np.array(artifact['samples'])
+
+
+def load_draws(df=None, data_path=MASTER_DATA, artifact_path=BOOTSTRAP_ARTIFACT, **kwargs):
+    """Load the cached draws, redrawing only when the data hash has changed."""
+    samples = read_draws(data_path, artifact_path)
+    if samples is not None:
+        return samples
+
+    if df is None:
+        df = pd.read_csv(data_path, converters={'countyfips': str})
+    data_hash = file_hash(data_path)
+    samples = draw(df, **kwargs)
+    save_model({'formula': FORMULA, 'data_hash': data_hash, 'coefficients': list(COEFFICIENTS),
+                'samples': samples.tolist()}, artifact_path)
+    return samples
+
+
+## Intervals ##
+
+def interval(values, level=LEVEL):
+    """Return the lower and upper percentiles of values over the draws (first axis)."""
+    tail = (1 - level) / 2 * 100
+    return np.percentile(values, [tail, 100 - tail], axis=0)
+
+
+def total_draws(engine, samples, Emissions, Smoking, Healthcare, rows=None, chunk=CHUNK):
+    """Return a (draws, counties) int array of total reduced cases for every draw.
+
+    ``engine`` is a scenario.ScenarioEngine or GroupedEngine and rows
+    optionally selects counties by sorted position.  The draws are evaluated
+    CHUNK at a time to bound the memory of the (draws, 3, counties) impacts.
+    """
+    totals = []
+    for start in range(0, len(samples), chunk):
+        impacts = engine.sample_impacts(samples[start:start + chunk], Emissions, Smoking, Healthcare, rows)
+        totals.append(impacts.sum(axis=1))
+    return np.concatenate(totals)
+
+
+def impact_intervals(totals, codes=None, level=LEVEL):
+    """Return (2, counties) lower and upper bounds of the reduced cases of every county.
+
+    ``totals`` is a (draws, counties) array of total_draws().  With the
+    State ``codes`` of those counties (regions.StateRollup codes) the bounds
+    are of the State totals instead, (2, States) in the order of the codes
+    (StateRollup.present()).  Monetary bounds are these times ASTHMA_COST /
+    MONETARY_UNIT.
+    """
+    if codes is not None:
+        states, codes = np.unique(codes, return_inverse=True)
+        # Draw d of State s lands in bin d * States + s
+        bins = (np.arange(len(totals))[:, None] * len(states) + codes).ravel()
+        totals = np.bincount(bins, weights=totals.ravel(), minlength=len(totals) * len(states)).reshape(
+            len(totals), len(states))
+    return interval(totals, level)
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    if sys.argv[1:2] == ['tracts']:
+        import pipeline
+        import store
+        samples = load_draws(store.load(pipeline.TRACT_STORE), os.path.join(pipeline.TRACT_STORE, store.MANIFEST),
+                             TRACT_BOOTSTRAP_ARTIFACT)
+    elif sys.argv[1:2] == ['year']:
+        import store
+        partition = store.partition_dir(sys.argv[2])
+        samples = load_draws(store.load(partition), os.path.join(partition, store.MANIFEST),
+                             os.path.join(store.year_dir(sys.argv[2]), YEAR_BOOTSTRAP_ARTIFACT))
+    else:
+        samples = load_draws()
+    print('{:,} draws in {:.1f} s'.format(len(samples), time.perf_counter() - start))
+    for name, (lower, upper) in zip(COEFFICIENTS, interval(samples).T):
+        print('{} {:.0%} interval = [{}, {}]'.format(name, LEVEL, lower, upper))
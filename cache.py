@@ -0,0 +1,274 @@
+"""Bounded LRU cache of rendered dashboard figures.
+
+Slider values move in 0.1 steps and the other inputs take a small set of
+values, so most requests repeat a few dozen dashboard states.  Figures are
+kept in least recently used order until their combined size exceeds a byte
+budget.
+
+FigureCache keeps them in the memory of one process.  SharedFigureCache
+keeps them in a SQLite database that every worker process of a server reads
+and writes, so a figure is rendered once for all of them.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import plotly.utils
+
+from profiling import memory_usage
+
+# Seconds between the updates of a worker's counters in the shared database
+STATS_INTERVAL = 1.0
+
+
+def quantize(value, step=0.1):
+    """Return value as a whole number of steps, or None if it is off the grid."""
+    steps = round(value / step)
+    if abs(steps * step - value) > 1e-9:
+        return None
+    return steps
+
+
+def figure_json(figure):
+    """Return a figure dict as JSON, without its shared geometry."""
+    data = [{key: value for key, value in trace.items() if key != 'geojson'} for trace in figure['data']]
+    return json.dumps({'data': data, 'layout': figure['layout']}, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def value_size(value):
+    # Bytes of arrays and strings, a word for any other value
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            # Hover names and mixed hover columns
+            return sum(len(item) if isinstance(item, str) else 8 for item in value.ravel())
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key) + value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) for item in value)
+    return 8
+
+
+def figure_size(figure):
+    """Approximate bytes held by a figure dict, not counting shared geometry.
+
+    Adds up the sizes of its arrays and strings instead of serializing it.
+    """
+    traces = [{key: value for key, value in trace.items() if key != 'geojson'} for trace in figure['data']]
+    return value_size(traces) + value_size(figure['layout'])
+
+
+class FigureCache:
+    """Thread-safe LRU cache of figures bounded by ``max_bytes``."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached figure for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, figure, size=None):
+        """Cache a figure, evicting the least recently used ones over budget."""
+        if size is None:
+            size = figure_size(figure)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (figure, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else None,
+            }
+        stats['workers'] = [dict({key: stats[key] for key in ('hits', 'misses', 'evictions', 'hit_rate')},
+                                 pid=os.getpid(), **memory_usage())]
+        return stats
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedFigureCache:
+    """LRU cache of figures bounded by ``max_bytes``, shared by processes in SQLite.
+
+    Figures are stored as JSON without their geometry; ``geometry(key,
+    figure)`` returns the geojson to attach to a figure read back (or None).  The
+    database is emptied when opened with another ``version`` (of the data,
+    model or geometry).  Hit and miss counters are kept per process and
+    written to the database with the process' memory use at most every
+    STATS_INTERVAL seconds, stats() reports every live process.
+    """
+
+    def __init__(self, path, max_bytes, version=None, geometry=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.geometry = geometry
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset()
+
+        # Not kept open, the process creating the cache may fork the workers
+        db = self._open()
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('CREATE TABLE IF NOT EXISTS figures (key TEXT PRIMARY KEY, figure TEXT, size INTEGER, used REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS figures_used ON figures (used)')
+        db.execute('CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, hits INTEGER, misses INTEGER, '
+                   'evictions INTEGER, rss INTEGER, pss INTEGER, shared INTEGER, private INTEGER, updated REAL)')
+        db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        row = db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is None or row[0] != str(version):
+            db.execute('DELETE FROM figures')
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(version),))
+        db.execute('COMMIT')
+        db.close()
+
+    def _reset(self):
+        # Counters of this process, a forked worker starts its own
+        self._pid = os.getpid()
+        self._reported = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def _connect(self):
+        # One connection per thread and process, connections don't survive a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db, self._local.pid = self._open(), os.getpid()
+        return self._local.db
+
+    def _count(self, hits=0, misses=0, evictions=0, report=False):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+            report = report or time.monotonic() - self._reported >= STATS_INTERVAL
+            if report:
+                self._reported = time.monotonic()
+        if report:
+            self._report()
+
+    def _report(self):
+        memory = memory_usage()
+        with self._lock:
+            row = (os.getpid(), self.hits, self.misses, self.evictions,
+                   memory['rss'], memory['pss'], memory['shared'], memory['private'], time.time())
+        self._connect().execute('INSERT OR REPLACE INTO workers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+
+    def get(self, key):
+        """Return the cached figure for key, or None."""
+        encoded = json.dumps(key)
+        db = self._connect()
+        row = db.execute('SELECT figure FROM figures WHERE key = ?', (encoded,)).fetchone()
+        if row is None:
+            self._count(misses=1)
+            return None
+        db.execute('UPDATE figures SET used = ? WHERE key = ?', (time.time(), encoded))
+        self._count(hits=1)
+        figure = json.loads(row[0])
+        geojson = None if self.geometry is None else self.geometry(key, figure)
+        if geojson is not None:
+            figure['data'][0]['geojson'] = geojson
+        return figure
+
+    def put(self, key, figure):
+        """Cache a figure, evicting the least recently used ones over budget."""
+        data = figure_json(figure)
+        if len(data) > self.max_bytes:
+            return
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)', (json.dumps(key), data, len(data), time.time()))
+            excess = db.execute('SELECT SUM(size) FROM figures').fetchone()[0] - self.max_bytes
+            evicted = []
+            if excess > 0:
+                for evicted_key, size in db.execute('SELECT key, size FROM figures ORDER BY used'):
+                    evicted.append(evicted_key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                db.executemany('DELETE FROM figures WHERE key = ?', [(evicted_key,) for evicted_key in evicted])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        if evicted:
+            self._count(evictions=len(evicted))
+
+    def stats(self):
+        self._count(report=True)
+        db = self._connect()
+        entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM figures').fetchone()
+        workers = []
+        for row in db.execute('SELECT pid, hits, misses, evictions, rss, pss, shared, private, updated FROM workers ORDER BY pid').fetchall():
+            if not process_alive(row[0]):
+                db.execute('DELETE FROM workers WHERE pid = ?', (row[0],))
+                continue
+            worker = dict(zip(('pid', 'hits', 'misses', 'evictions', 'rss', 'pss', 'shared', 'private', 'updated'), row))
+            requests = worker['hits'] + worker['misses']
+            worker['hit_rate'] = worker['hits'] / requests if requests else None
+            workers.append(worker)
+        hits, misses = sum(worker['hits'] for worker in workers), sum(worker['misses'] for worker in workers)
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': sum(worker['evictions'] for worker in workers),
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'workers': workers,
+        }
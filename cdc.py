@@ -0,0 +1,79 @@
+"""Streaming ingest of the CDC PLACES county data.
+
+Replaces "CDC Data.ipynb", which downloaded all ~130 columns of dataset
+i46a-9kgh with a hard-coded limit of 4000 rows.  Only the columns the
+pipeline uses are requested, results are paged with $limit/$offset until the
+dataset is exhausted and every page goes straight into the columnar store in
+Data/cdc, so the full response is never held in memory.
+
+    python cdc.py
+
+The census tract estimates are published as a separate dataset of each
+PLACES release; pass its id to stream them into Data/cdc_tract:
+
+    python cdc.py tracts <dataset id>
+
+Other years of the county data are published as datasets of earlier or later
+releases; stream one into the sources of its year in Data/years/<year> with:
+
+    python cdc.py year <year> <dataset id>
+
+``CDC_URL`` points the ingest at another Socrata server, such as a local
+stub.  The store is exported to CSV with ``python store.py export``.
+"""
+import os
+import sys
+
+import pandas as pd
+
+import pipeline
+import store
+from aqs import session
+
+CDC_URL = os.environ.get('CDC_URL', 'https://chronicdata.cdc.gov')
+DATASET = 'i46a-9kgh'
+
+# Rows per request and seconds to wait for a response
+PAGE_SIZE = 1000
+TIMEOUT = 60
+
+# Socrata returns every value as a string, these columns are stored as integers
+DTYPES = {'totalpopulation': 'int64'}
+
+
+def pages(http, columns=pipeline.CDC_COLUMNS, page_size=PAGE_SIZE, base_url=CDC_URL, dataset=DATASET, timeout=TIMEOUT):
+    """Yield the selected columns of the dataset as DataFrames of up to page_size rows."""
+    offset = 0
+    while True:
+        # Paging needs a stable order, :id is the Socrata row id
+        response = http.get('{}/resource/{}.json'.format(base_url, dataset), timeout=timeout, params={
+            '$select': ','.join(columns), '$order': ':id', '$limit': page_size, '$offset': offset})
+        response.raise_for_status()
+        records = response.json()
+        if records:
+            yield pd.DataFrame.from_records(records, columns=columns)
+        if len(records) < page_size:
+            return
+        offset += page_size
+
+
+def ingest(store_dir=pipeline.CDC_STORE, columns=pipeline.CDC_COLUMNS, **kwargs):
+    """Stream the dataset into a columnar store and return its manifest."""
+    writer = store.StoreWriter(columns, store_dir, DTYPES)
+    with session(1) as http:
+        for page in pages(http, columns, **kwargs):
+            writer.append(page)
+    return writer.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['tracts']:
+        store_dir = pipeline.CDC_TRACT_STORE
+        manifest = ingest(store_dir, pipeline.TRACT_CDC_COLUMNS, dataset=sys.argv[2])
+    elif sys.argv[1:2] == ['year']:
+        store_dir = pipeline.year_cdc_store(sys.argv[2])
+        manifest = ingest(store_dir, dataset=sys.argv[3])
+    else:
+        store_dir = pipeline.CDC_STORE
+        manifest = ingest()
+    print('{}: {:,} rows, {} columns'.format(store_dir, manifest['rows'], len(manifest['columns'])))
@@ -0,0 +1,311 @@
+"""Least squares with group fixed effects by within transformation.
+
+Fitting ``y ~ X + C(group)`` with an OLS on a dense design matrix costs
+rows x groups.  Here every column is demeaned by group (a segment mean) and
+only the small least squares problem of the regressors that vary within
+groups is solved; the group intercepts follow from the group means.
+
+Results are reported in the parameterization of the dummy variable OLS:
+an intercept, treatment coded group dummies (first group as reference) and
+the regressors in their given order.  Regressors that are constant within
+every group are collinear with the dummies, and like statsmodels' pinv based
+OLS the minimum norm solution is reported for them, with matching standard
+errors.
+
+fit_batch() refits the same model for many sets of frequency weights at once
+(bootstrap resamples), with the within regressions stacked into one batched
+solve.
+
+Moments keeps the sufficient statistics of the model by group (counts,
+means, centered cross products of the regressors and the dependent variable,
+and the column ranges that tell constant regressors apart).  Moments of
+separate partitions of the rows merge exactly, so new rows are folded in and
+stale partitions dropped without the rows of the others, and fit_moments()
+solves the model from them in time independent of the number of rows.
+"""
+import numpy as np
+import pandas as pd
+
+COV_TYPES = ('nonrobust', 'HC0', 'HC1', 'cluster')
+
+
+def segment_mean(codes, values, counts):
+    """Return the mean of the (rows, columns) values by group code."""
+    sums = np.stack([np.bincount(codes, weights=column, minlength=len(counts)) for column in values.T], axis=1)
+    return sums / counts[:, None]
+
+
+def dummy_map(values, constant):
+    """Return the matrix mapping (group intercepts, slopes) to the reported params.
+
+    The slopes are those of the regressors that vary within groups, values
+    is a (groups, columns) array of a row of every group.  Constant
+    regressors are set to zero, then the null space of the dummy design is
+    projected out to get the minimum norm solution.
+    """
+    G, columns = values.shape
+    k = columns - constant.sum()
+    p = G + columns
+    varying_index = G + np.flatnonzero(~constant)
+    R = np.zeros((p, G + k))
+    R[0, 0] = 1
+    R[1:G, 0] = -1
+    R[np.arange(1, G), np.arange(1, G)] = 1
+    R[varying_index, G + np.arange(k)] = 1
+
+    null = []
+    for j in np.flatnonzero(constant):
+        value = values[:, j]
+        v = np.zeros(p)
+        v[0] = value[0]
+        v[1:G] = value[1:] - value[0]
+        v[G + j] = -1
+        null.append(v)
+    if not null:
+        return R
+    V = np.array(null).T
+    return R - V @ np.linalg.solve(V.T @ V, V.T @ R)
+
+
+def cross_inverse(counts, means, W_inv):
+    """Return the inverse of the cross product of [group indicators, varying regressors]."""
+    G, k = means.shape
+    H = np.empty((G + k, G + k))
+    H[:G, :G] = np.diag(1 / counts) + means @ W_inv @ means.T
+    H[:G, G:] = -means @ W_inv
+    H[G:, :G] = H[:G, G:].T
+    H[G:, G:] = W_inv
+    return H
+
+
+def fit(y, X, groups, cov_type='nonrobust'):
+    """Fit y on the columns of X with fixed effects for groups.
+
+    ``cov_type`` is 'nonrobust', 'HC0', 'HC1' or 'cluster' (clustered by
+    group), with the same small sample corrections as statsmodels.  Returns
+    a dict with the group labels, params and bse arrays ordered as
+    [intercept, dummies of groups[1:], columns of X], nobs and df_resid.
+    """
+    if cov_type not in COV_TYPES:
+        raise ValueError('Unknown cov_type {!r}, expected one of {}'.format(cov_type, COV_TYPES))
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64).reshape(len(y), -1)
+    codes, labels = pd.factorize(np.asarray(groups), sort=True)
+    n, columns = X.shape
+    counts = np.bincount(codes).astype(np.float64)
+    G = len(labels)
+
+    # Regressors constant within every group are absorbed by the fixed effects
+    first = np.unique(codes, return_index=True)[1]
+    constant = np.all(X == X[first][codes], axis=0)
+    varying = ~constant
+    Xv = X[:, varying]
+    k = Xv.shape[1]
+
+    # Within regression
+    means = segment_mean(codes, Xv, counts)
+    y_mean = np.bincount(codes, weights=y, minlength=G) / counts
+    Xw = Xv - means[codes]
+    W_inv = np.linalg.inv(Xw.T @ Xw)
+    slopes = W_inv @ (Xw.T @ (y - y_mean[codes]))
+    intercepts = y_mean - means @ slopes
+    resid = y - intercepts[codes] - Xv @ slopes
+    df_resid = n - G - k
+
+    H = cross_inverse(counts, means, W_inv)
+
+    if cov_type == 'nonrobust':
+        cov = H * (resid @ resid / df_resid)
+    else:
+        if cov_type == 'cluster':
+            scores = np.empty((G, G + k))
+            scores[:, :G] = np.diag(np.bincount(codes, weights=resid, minlength=G))
+            scores[:, G:] = np.stack([np.bincount(codes, weights=column * resid, minlength=G) for column in Xv.T], axis=1)
+            meat = scores.T @ scores
+            # statsmodels counts every column of the dummy design
+            scale = G / (G - 1) * (n - 1) / (n - (1 + (G - 1) + columns))
+        else:
+            e2 = resid ** 2
+            meat = np.empty((G + k, G + k))
+            meat[:G, :G] = np.diag(np.bincount(codes, weights=e2, minlength=G))
+            meat[:G, G:] = np.stack([np.bincount(codes, weights=column * e2, minlength=G) for column in Xv.T], axis=1)
+            meat[G:, :G] = meat[:G, G:].T
+            meat[G:, G:] = (Xv * e2[:, None]).T @ Xv
+            scale = n / df_resid if cov_type == 'HC1' else 1.0
+        cov = H @ meat @ H * scale
+
+    M = dummy_map(X[first], constant)
+    theta = np.concatenate([intercepts, slopes])
+    cov = M @ cov @ M.T
+    return {
+        'groups': list(labels),
+        'params': M @ theta,
+        'bse': np.sqrt(np.diag(cov)),
+        'nobs': n,
+        'df_resid': df_resid,
+    }
+
+
+def fit_batch(y, X, groups, weights):
+    """Fit y on the columns of X with fixed effects for groups, once per row of weights.
+
+    ``weights`` is a (fits, rows) array of frequency weights, such as the
+    number of times every row was drawn by a bootstrap resample; a fit
+    equals fit() on the rows repeated that many times.  Every group needs a
+    positive weight in every fit.  Returns a (fits, params) array ordered
+    like fit()'s params.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64).reshape(len(y), -1)
+    W = np.asarray(weights, dtype=np.float64).reshape(-1, len(y))
+    codes, labels = pd.factorize(np.asarray(groups), sort=True)
+    G = len(labels)
+
+    first = np.unique(codes, return_index=True)[1]
+    constant = np.all(X == X[first][codes], axis=0)
+    Xv = X[:, ~constant]
+    k = Xv.shape[1]
+
+    # Weighted group sums of every fit, as segment sums over rows sorted by group
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], np.arange(G))
+    Ws = W[:, order]
+
+    def group_sums(values):
+        return np.add.reduceat(Ws * values[order], starts, axis=1)
+
+    counts = np.add.reduceat(Ws, starts, axis=1)
+    means = np.stack([group_sums(column) for column in Xv.T], axis=2) / counts[:, :, None]
+    y_mean = group_sums(y) / counts
+
+    # Within cross products: raw weighted moments less the group mean terms
+    XtX = (W @ (Xv[:, :, None] * Xv[:, None, :]).reshape(len(y), k * k)).reshape(-1, k, k)
+    XtX -= np.einsum('fg,fgi,fgj->fij', counts, means, means)
+    Xty = W @ (Xv * y[:, None])
+    Xty -= np.einsum('fg,fgi,fg->fi', counts, means, y_mean)
+    slopes = np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]
+    intercepts = y_mean - np.einsum('fgi,fi->fg', means, slopes)
+
+    theta = np.concatenate([intercepts, slopes], axis=1)
+    return theta @ dummy_map(X[first], constant).T
+
+
+class Moments:
+    """Sufficient statistics of [X, y] by group, mergeable across partitions of the rows.
+
+    ``cross`` holds the (columns + 1) square cross products of every group's
+    rows centered on its means, merged with the pairwise update of Chan et
+    al. rather than as raw sums, which would lose the within group variation
+    of regressors with large means to cancellation.
+    """
+
+    def __init__(self, groups, counts, means, cross, low, high):
+        self.groups = list(groups)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.cross = np.asarray(cross, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+
+    @classmethod
+    def from_data(cls, y, X, groups):
+        y = np.asarray(y, dtype=np.float64)
+        Z = np.column_stack([np.asarray(X, dtype=np.float64).reshape(len(y), -1), y])
+        codes, labels = pd.factorize(np.asarray(groups), sort=True)
+        counts = np.bincount(codes, minlength=len(labels)).astype(np.float64)
+        means = segment_mean(codes, Z, counts)
+        centered = Z - means[codes]
+        order = np.argsort(codes, kind='stable')
+        starts = np.searchsorted(codes[order], np.arange(len(labels)))
+        cross = np.add.reduceat(centered[order, :, None] * centered[order, None, :], starts, axis=0)
+        return cls(labels.tolist(), counts, means, cross,
+                   np.minimum.reduceat(Z[order], starts), np.maximum.reduceat(Z[order], starts))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['groups'], data['counts'], data['means'], data['cross'], data['low'], data['high'])
+
+    def to_dict(self):
+        return {'groups': self.groups, 'counts': self.counts.tolist(), 'means': self.means.tolist(),
+                'cross': self.cross.tolist(), 'low': self.low.tolist(), 'high': self.high.tolist()}
+
+    def merge(self, other):
+        """Return the moments of the rows of both, as if computed on them together."""
+        groups = sorted(set(self.groups) | set(other.groups))
+        index = {group: i for i, group in enumerate(groups)}
+        p = self.means.shape[1]
+        merged = Moments(groups, np.zeros(len(groups)), np.zeros((len(groups), p)), np.zeros((len(groups), p, p)),
+                         np.full((len(groups), p), np.inf), np.full((len(groups), p), -np.inf))
+        for part in (self, other):
+            rows = np.array([index[group] for group in part.groups], dtype=np.intp)
+            n_a = merged.counts[rows]
+            n = n_a + part.counts
+            delta = part.means - merged.means[rows]
+            merged.cross[rows] += part.cross + (n_a * part.counts / n)[:, None, None] * delta[:, :, None] * delta[:, None, :]
+            merged.means[rows] += delta * (part.counts / n)[:, None]
+            merged.counts[rows] = n
+            merged.low[rows] = np.minimum(merged.low[rows], part.low)
+            merged.high[rows] = np.maximum(merged.high[rows], part.high)
+        return merged
+
+
+def combine(parts):
+    """Return the merged Moments of a sequence of partitions."""
+    parts = list(parts)
+    if not parts:
+        raise ValueError('No moments to combine')
+    moments = parts[0]
+    for part in parts[1:]:
+        moments = moments.merge(part)
+    return moments
+
+
+def fit_moments(moments, cov_type='nonrobust'):
+    """Fit the model of fit() from the Moments of its rows.
+
+    Returns the dict of fit() for the same rows.  Only 'nonrobust' and
+    'cluster' standard errors follow from the moments, heteroskedasticity
+    robust ones need the residuals of every row.
+    """
+    if cov_type not in ('nonrobust', 'cluster'):
+        raise ValueError('cov_type {!r} needs the rows, fit_moments supports nonrobust and cluster'.format(cov_type))
+    counts = moments.counts
+    G = len(counts)
+    columns = moments.means.shape[1] - 1
+    n = int(counts.sum())
+
+    constant = np.all(moments.low[:, :columns] == moments.high[:, :columns], axis=0)
+    varying = np.flatnonzero(~constant)
+    k = len(varying)
+
+    # Within regression from the pooled within group cross products
+    Wxx = moments.cross[:, varying[:, None], varying].sum(axis=0)
+    Wxy = moments.cross[:, varying, columns].sum(axis=0)
+    W_inv = np.linalg.inv(Wxx)
+    slopes = W_inv @ Wxy
+    means = moments.means[:, varying]
+    intercepts = moments.means[:, columns] - means @ slopes
+    df_resid = n - G - k
+
+    H = cross_inverse(counts, means, W_inv)
+    if cov_type == 'nonrobust':
+        rss = moments.cross[:, columns, columns].sum() - slopes @ Wxy
+        cov = H * (rss / df_resid)
+    else:
+        # The residuals of every group sum to zero, and their products with
+        # the regressors are the centered cross products less the fit
+        scores = np.zeros((G, G + k))
+        scores[:, G:] = moments.cross[:, varying, columns] - moments.cross[:, varying[:, None], varying] @ slopes
+        scale = G / (G - 1) * (n - 1) / (n - (1 + (G - 1) + columns))
+        cov = H @ (scores.T @ scores) @ H * scale
+
+    M = dummy_map(moments.low[:, :columns], constant)
+    theta = np.concatenate([intercepts, slopes])
+    cov = M @ cov @ M.T
+    return {
+        'groups': list(moments.groups),
+        'params': M @ theta,
+        'bse': np.sqrt(np.diag(cov)),
+        'nobs': n,
+        'df_resid': df_resid,
+    }
@@ -0,0 +1,304 @@
+"""Local county and tract geometry store.
+
+County boundaries ship with the project in Data/geo as gzipped GeoJSON at
+several pre-simplified resolution levels, so the dashboard starts offline and
+only loads the level it needs the first time a map is drawn.  Census tract
+boundaries are stored one file per State (Data/geo/tracts_<level>/<state
+FIPS>.json.gz) and loaded only when a State's tracts are shown.
+
+The levels are built from a county GeoJSON keyed by FIPS code (by default the
+file the dashboard used to download at startup), a tract GeoJSON keyed by
+tract FIPS code (e.g. the Census cartographic boundary files converted to
+GeoJSON) and a State GeoJSON keyed by postal abbreviation with:
+
+    python geometry.py [source.json or URL]
+    python geometry.py tracts tracts.json
+    python geometry.py basemap states.json
+
+The basemap is the topojson plotly.js draws the land and State borders of the
+USA scope from.  It is served from assets/topojson, so no map ever fetches
+tiles or topojson from the plotly CDN.
+
+Simplification splits every ring at the vertices where county borders meet
+and runs Douglas-Peucker on each border in a canonical direction.  Both
+counties sharing a border keep identical vertices, so neighbours never open
+gaps or overlap the way independently simplified polygons do.
+"""
+import functools
+import gzip
+import json
+import math
+import os
+import sys
+
+GEO_DIR = os.path.join('Data', 'geo')
+SOURCE_URL = 'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json'
+
+# Simplification tolerance in degrees of each resolution level (0.01 degrees
+# is about a quarter of a pixel on the 1300px wide national map)
+LEVELS = {'high': 0.001, 'medium': 0.002, 'low': 0.01}
+DEFAULT_LEVEL = os.environ.get('ASTHMA_GEOMETRY_LEVEL', 'low')
+# Tracts are drawn zoomed in on the selected States, with finer tolerances
+TRACT_LEVELS = {'high': 0.0002, 'medium': 0.0005, 'low': 0.001}
+# States whose tract geometry stays loaded
+TRACT_STATES = 8
+
+# Topojson read by plotly.js for scope="usa" (topojsonURL + usa_110m.json)
+BASEMAP_PATH = os.path.join('assets', 'topojson', 'usa_110m.json')
+BASEMAP_TOLERANCE = 0.02
+BASEMAP_LAYERS = ('land', 'subunits', 'countries', 'coastlines', 'lakes', 'ocean', 'rivers')
+
+
+def level_path(level):
+    return os.path.join(GEO_DIR, 'counties_{}.json.gz'.format(level))
+
+
+@functools.lru_cache(maxsize=None)
+def load_counties(level=DEFAULT_LEVEL):
+    """Return the county FeatureCollection of a resolution level."""
+    if level not in LEVELS:
+        raise ValueError('Unknown geometry level {!r}, expected one of {}'.format(level, sorted(LEVELS)))
+    with gzip.open(level_path(level), 'rt') as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def county_index(level=DEFAULT_LEVEL):
+    """Return a dict mapping county FIPS codes to their features."""
+    return {feature['id']: feature for feature in load_counties(level)['features']}
+
+
+def county_subset(fips, level=DEFAULT_LEVEL):
+    """Return a FeatureCollection with only the counties in ``fips``."""
+    index = county_index(level)
+    return {'type': 'FeatureCollection', 'features': [index[code] for code in fips if code in index]}
+
+
+def tract_path(state, level):
+    return os.path.join(GEO_DIR, 'tracts_{}'.format(level), '{}.json.gz'.format(state))
+
+
+@functools.lru_cache(maxsize=TRACT_STATES)
+def tract_index(state, level=DEFAULT_LEVEL):
+    """Return a dict mapping the tract FIPS codes of a State to their features."""
+    if level not in TRACT_LEVELS:
+        raise ValueError('Unknown geometry level {!r}, expected one of {}'.format(level, sorted(TRACT_LEVELS)))
+    with gzip.open(tract_path(state, level), 'rt') as f:
+        return {feature['id']: feature for feature in json.load(f)['features']}
+
+
+def tract_subset(fips, level=DEFAULT_LEVEL):
+    """Return a FeatureCollection with only the tracts in ``fips``.
+
+    The first two digits of a tract FIPS code are its State's, only the
+    States of the selected tracts are loaded.
+    """
+    features = []
+    for code in fips:
+        feature = tract_index(code[:2], level).get(code)
+        if feature is not None:
+            features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+## Simplification ##
+
+def junctions(rings):
+    # Vertices where the set of neighbouring vertices differs between the
+    # rings sharing them: the ends of the border shared by two counties
+    neighbours = {}
+    fixed = set()
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            pair = frozenset((points[i - 1], points[(i + 1) % len(points)]))
+            if neighbours.setdefault(point, pair) != pair:
+                fixed.add(point)
+    return fixed
+
+
+def douglas_peucker(points, tolerance):
+    # Keep the end points and every vertex further than tolerance from the
+    # simplified line, iteratively to avoid deep recursion on long borders
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        best, index = tolerance, None
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if norm:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / norm
+            else:
+                distance = math.hypot(x - x1, y - y1)
+            if distance > best:
+                best, index = distance, i
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_arc(arc, tolerance):
+    # Simplify in a canonical direction so both counties sharing a border
+    # keep exactly the same vertices
+    if arc[-1] < arc[0]:
+        return douglas_peucker(arc[::-1], tolerance)[::-1]
+    return douglas_peucker(arc, tolerance)
+
+
+def simplify_ring(ring, fixed, tolerance, digits):
+    points = ring[:-1]
+    cuts = [i for i, point in enumerate(points) if point in fixed]
+    if not cuts:
+        # Ring without junctions (an island or an enclosed county): start at
+        # its smallest vertex and split it at the vertex furthest away
+        start = points.index(min(points))
+        points = points[start:] + points[:start]
+        far = max(range(len(points)), key=lambda i: math.hypot(points[i][0] - points[0][0], points[i][1] - points[0][1]))
+        cuts = [0, far] if far else [0]
+    points = points[cuts[0]:] + points[:cuts[0]]
+    cuts = [cut - cuts[0] for cut in cuts] + [len(points)]
+    points.append(points[0])
+
+    out = []
+    for first, last in zip(cuts, cuts[1:]):
+        out.extend(simplify_arc(points[first:last + 1], tolerance)[:-1])
+    out.append(out[0])
+
+    # Round to the precision of the level and drop repeated points
+    rounded = []
+    for x, y in out:
+        point = [round(x, digits), round(y, digits)]
+        if not rounded or rounded[-1] != point:
+            rounded.append(point)
+    if len(rounded) < 4:
+        return None
+    return rounded
+
+
+def polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def simplify(source, tolerance):
+    """Return a simplified copy of a FeatureCollection keeping only the FIPS ids.
+
+    Counties smaller than the tolerance keep their source geometry rather
+    than vanishing from the map.
+    """
+    digits = max(0, 1 - int(math.floor(math.log10(tolerance))))
+    shapes = [[[[tuple(point) for point in ring] for ring in polygon] for polygon in polygons(feature['geometry'])]
+              for feature in source['features']]
+    fixed = junctions([ring for shape in shapes for polygon in shape for ring in polygon])
+
+    features = []
+    for feature, shape in zip(source['features'], shapes):
+        simplified = []
+        for polygon in shape:
+            rings = [simplify_ring(ring, fixed, tolerance, digits) for ring in polygon]
+            if rings[0] is not None:
+                simplified.append([ring for ring in rings if ring is not None])
+        if not simplified:
+            geometry = feature['geometry']
+        elif len(simplified) == 1:
+            geometry = {'type': 'Polygon', 'coordinates': simplified[0]}
+        else:
+            geometry = {'type': 'MultiPolygon', 'coordinates': simplified}
+        features.append({'type': 'Feature', 'id': feature['id'], 'properties': {}, 'geometry': geometry})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def read_source(source):
+    if source.startswith(('http://', 'https://')):
+        from urllib.request import urlopen
+        with urlopen(source) as response:
+            return json.load(response)
+    with open(source) as f:
+        return json.load(f)
+
+
+def feature_ids(source, key):
+    # Use the id of every feature, or its ``key`` property when it has none
+    for feature in source['features']:
+        if feature.get('id') is None:
+            feature['id'] = feature['properties'][key]
+    return source
+
+
+def build(source=SOURCE_URL):
+    """Write every resolution level of the county geometry to Data/geo."""
+    counties = read_source(source)
+    os.makedirs(GEO_DIR, exist_ok=True)
+    for level, tolerance in LEVELS.items():
+        with gzip.open(level_path(level), 'wt') as f:
+            json.dump(simplify(counties, tolerance), f, separators=(',', ':'))
+        print('{}: {:,} bytes'.format(level_path(level), os.path.getsize(level_path(level))))
+
+
+def build_tracts(source):
+    """Write every resolution level of the tract geometry, one file per State.
+
+    Simplified as a whole, so tracts on either side of a State line keep the
+    same border.
+    """
+    tracts = feature_ids(read_source(source), 'GEOID')
+    for level, tolerance in TRACT_LEVELS.items():
+        by_state = {}
+        for feature in simplify(tracts, tolerance)['features']:
+            by_state.setdefault(feature['id'][:2], []).append(feature)
+        os.makedirs(os.path.dirname(tract_path('', level)), exist_ok=True)
+        for state, features in by_state.items():
+            with gzip.open(tract_path(state, level), 'wt') as f:
+                json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+        print('{}: {:,} States'.format(os.path.dirname(tract_path('', level)), len(by_state)))
+
+
+def basemap(states, tolerance=BASEMAP_TOLERANCE):
+    """Return the USA scope topojson of a State FeatureCollection.
+
+    The States are both the land and the subunits plotly.js looks up for
+    locationmode="USA-states" (ids are postal abbreviations, ``ct`` is the
+    label position).  Every ring is its own arc, and the other layers are
+    left empty: the State borders already outline the country.
+    """
+    arcs = []
+    subunits = []
+    for feature in simplify(states, tolerance)['features']:
+        shape = []
+        for polygon in polygons(feature['geometry']):
+            shape.append([[len(arcs) + i] for i in range(len(polygon))])
+            arcs.extend([[round(x, 3), round(y, 3)] for x, y in ring] for ring in polygon)
+        points = [point for polygon in polygons(feature['geometry']) for point in polygon[0][:-1]]
+        center = [round(sum(x for x, _ in points) / len(points), 2), round(sum(y for _, y in points) / len(points), 2)]
+        subunits.append({'type': 'MultiPolygon', 'arcs': shape, 'id': feature['id'], 'properties': {'ct': center}})
+
+    objects = {layer: {'type': 'GeometryCollection', 'geometries': []} for layer in BASEMAP_LAYERS}
+    objects['subunits']['geometries'] = subunits
+    objects['land']['geometries'] = [{'type': 'MultiPolygon', 'arcs': [polygon for subunit in subunits for polygon in subunit['arcs']]}]
+    return {'type': 'Topology', 'objects': objects, 'arcs': arcs}
+
+
+def build_basemap(source):
+    """Write the USA scope topojson of a State GeoJSON to assets/topojson."""
+    topology = basemap(feature_ids(read_source(source), 'STUSPS'))
+    os.makedirs(os.path.dirname(BASEMAP_PATH), exist_ok=True)
+    with open(BASEMAP_PATH, 'w') as f:
+        json.dump(topology, f, separators=(',', ':'))
+    print('{}: {:,} bytes'.format(BASEMAP_PATH, os.path.getsize(BASEMAP_PATH)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['tracts']:
+        build_tracts(sys.argv[2])
+    elif sys.argv[1:2] == ['basemap']:
+        build_basemap(sys.argv[2])
+    else:
+        build(*sys.argv[1:])
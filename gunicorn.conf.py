@@ -0,0 +1,22 @@
+"""Production serving of the dashboard with gunicorn.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported once in the parent process (preload_app) and the
+workers are forked from it, sharing its memory-mapped dataset, scenario
+cube, model and geometry read only.  Rendered figures are cached in a SQLite
+file every worker reads and writes; http://<host>:8050/cache-stats reports
+the cache and every worker's hits, misses and memory use.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('ASTHMA_PRELOAD', '1')
+os.environ.setdefault('ASTHMA_FIGURE_CACHE_PATH', os.path.join('Data', 'figure_cache.sqlite'))
+
+wsgi_app = 'App:server'
+bind = os.environ.get('ASTHMA_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('ASTHMA_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('ASTHMA_THREADS', 4))
+preload_app = True
+timeout = 120
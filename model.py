@@ -0,0 +1,224 @@
+"""Fixed effects model artifact for the dashboard.
+
+The model is fit once and its coefficients and standard errors are stored on
+disk together with a content hash of the data it was fit on.  The dashboard
+loads the stored artifact at startup and only refits when Master_Data.csv
+changes.
+
+Build the artifact ahead of time with:
+
+    python model.py
+
+The census tract model is fit on the tract store (python pipeline.py tracts)
+and stored as its own artifact:
+
+    python model.py tracts
+
+Every year partition of the store (python pipeline.py year <year>) has its
+model stored next to its sources, in Data/years/<year>:
+
+    python model.py year 2020
+
+The pooled model is fit on the rows of every year together.  It is solved
+from the sufficient statistics of every partition (fixed_effects.Moments),
+cached next to the partition's model, so adding or rebuilding a year only
+reads that year and removing one only drops its statistics:
+
+    python model.py pooled
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import fixed_effects
+from pollutants import MODEL_POLLUTANT
+
+MASTER_DATA = os.path.join('Data', 'Master_Data.csv')
+MODEL_ARTIFACT = os.path.join('Data', 'fixed_model.json')
+TRACT_MODEL_ARTIFACT = os.path.join('Data', 'fixed_model_tract.json')
+# Artifact of a year partition, in the year's directory
+YEAR_MODEL_ARTIFACT = 'fixed_model.json'
+POOLED_MODEL_ARTIFACT = os.path.join('Data', 'fixed_model_pooled.json')
+# Sufficient statistics of a partition, next to its model artifact
+MOMENTS_ARTIFACT = 'moments.json'
+
+# State emissions of the model's pollutant, PM2.5 unless ASTHMA_MODEL_POLLUTANT
+# selects another (see pollutants.py)
+STATE_COLUMN = 'state_' + MODEL_POLLUTANT.name
+
+# Names of the coefficients used by the dashboard in the fitted params
+STATE_EMISSIONS = 'np.log({})'.format(STATE_COLUMN)
+CSMOKING_ADJPREV = 'csmoking_adjprev'
+ACCESS2_ADJPREV = 'access2_adjprev'
+PER_CAPITA_INCOME = 'np.log(per_capita_income)'
+
+# Fixed Effects Model, using State dummy variables as additional controls
+FORMULA = '''casthma_adjprev ~ {} + csmoking_adjprev +
+                    access2_adjprev + np.log(per_capita_income) + C(statedesc)'''.format(STATE_EMISSIONS)
+
+# FORMULA as fit by the within estimator: dependent variable, State groups
+# and the regressors in formula order
+DEPENDENT = 'casthma_adjprev'
+GROUPS = 'statedesc'
+REGRESSORS = {
+    STATE_EMISSIONS: lambda df: np.log(df[STATE_COLUMN]),
+    CSMOKING_ADJPREV: lambda df: df['csmoking_adjprev'],
+    ACCESS2_ADJPREV: lambda df: df['access2_adjprev'],
+    PER_CAPITA_INCOME: lambda df: np.log(df['per_capita_income']),
+}
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_data(df):
+    """Return the dependent variable, regressors and groups of FORMULA."""
+    if STATE_COLUMN not in df:
+        raise ValueError('The data has no {} column, rebuild it with {} in ASTHMA_POLLUTANTS'.format(
+            STATE_COLUMN, MODEL_POLLUTANT.code))
+    data = pd.DataFrame({name: regressor(df) for name, regressor in REGRESSORS.items()})
+    data[DEPENDENT] = df[DEPENDENT]
+    data[GROUPS] = df[GROUPS]
+    # Rows with missing values are dropped, as the formula interface does
+    return data.dropna()
+
+
+def fit_fixed_model(df, cov_type='nonrobust'):
+    """Fit the fixed effects model and return its coefficients and standard errors.
+
+    The State dummies are absorbed by a within transformation
+    (fixed_effects.fit) instead of a dense design matrix; params and standard
+    errors are named and valued like the statsmodels OLS of FORMULA.
+    """
+    data = model_data(df)
+    return model_artifact(fixed_effects.fit(data[DEPENDENT], data[list(REGRESSORS)], data[GROUPS], cov_type),
+                          cov_type)
+
+
+def model_artifact(fixed_model, cov_type):
+    # Name the params of a fixed_effects fit like the statsmodels OLS of FORMULA
+    names = (['Intercept'] + ['C({})[T.{}]'.format(GROUPS, group) for group in fixed_model['groups'][1:]]
+             + list(REGRESSORS))
+    return {
+        'formula': FORMULA,
+        'cov_type': cov_type,
+        'nobs': int(fixed_model['nobs']),
+        'params': {name: float(value) for name, value in zip(names, fixed_model['params'])},
+        'bse': {name: float(value) for name, value in zip(names, fixed_model['bse'])},
+    }
+
+
+def save_model(artifact, artifact_path=MODEL_ARTIFACT):
+    # Write to a temporary file first so a reader never sees a partial artifact
+    tmp_path = artifact_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(artifact, f, indent=2)
+    os.replace(tmp_path, artifact_path)
+
+
+def read_model(artifact_path=MODEL_ARTIFACT):
+    """Return the stored artifact, or None if it is missing or unreadable."""
+    try:
+        with open(artifact_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_model(df=None, data_path=MASTER_DATA, artifact_path=MODEL_ARTIFACT):
+    """Load the model artifact, refitting only when the data hash has changed."""
+    data_hash = file_hash(data_path)
+    artifact = read_model(artifact_path)
+    if artifact is not None and artifact.get('data_hash') == data_hash and artifact.get('formula') == FORMULA:
+        return artifact
+
+    if df is None:
+        df = pd.read_csv(data_path, converters={'countyfips': str})
+    artifact = fit_fixed_model(df)
+    artifact['data_hash'] = data_hash
+    save_model(artifact, artifact_path)
+    return artifact
+
+
+def load_moments(load, data_path, moments_path):
+    """Load the sufficient statistics of a partition, recomputing them when its data hash has changed.
+
+    ``load`` returns the partition's DataFrame and is only called then.
+    """
+    data_hash = file_hash(data_path)
+    artifact = read_model(moments_path)
+    if artifact is not None and artifact.get('data_hash') == data_hash and artifact.get('formula') == FORMULA:
+        return fixed_effects.Moments.from_dict(artifact['moments'])
+
+    data = model_data(load())
+    moments = fixed_effects.Moments.from_data(data[DEPENDENT], data[list(REGRESSORS)], data[GROUPS])
+    save_model({'formula': FORMULA, 'data_hash': data_hash, 'moments': moments.to_dict()}, moments_path)
+    return moments
+
+
+def pooled_model(partitions, cov_type='nonrobust', artifact_path=POOLED_MODEL_ARTIFACT):
+    """Fit the model on the rows of every partition from their sufficient statistics.
+
+    ``partitions`` maps a partition's name to the (load, data_path,
+    moments_path) of load_moments().  The artifact records the data hash of
+    every partition it was fit on.
+    """
+    moments = {name: load_moments(*partition) for name, partition in partitions.items()}
+    artifact = model_artifact(fixed_effects.fit_moments(fixed_effects.combine(moments.values()), cov_type), cov_type)
+    artifact['partitions'] = {name: file_hash(partition[1]) for name, partition in partitions.items()}
+    save_model(artifact, artifact_path)
+    return artifact
+
+
+def year_partitions():
+    """Return the pooled_model() partitions of Master_Data.csv and every year partition."""
+    import pipeline
+    import store
+
+    partitions = {str(pipeline.BASE_YEAR): (lambda: pd.read_csv(MASTER_DATA, converters={'countyfips': str}),
+                                            MASTER_DATA, os.path.join('Data', MOMENTS_ARTIFACT))}
+    for year in store.partitions():
+        if year == pipeline.BASE_YEAR:
+            continue
+        partition = store.partition_dir(year)
+        partitions[str(year)] = (lambda partition=partition: store.load(partition),
+                                 os.path.join(partition, store.MANIFEST),
+                                 os.path.join(store.year_dir(year), MOMENTS_ARTIFACT))
+    return partitions
+
+
+def coefficients(artifact):
+    """Return the (state emissions, smoking, health care access) coefficients."""
+    params = artifact['params']
+    return params[STATE_EMISSIONS], params[CSMOKING_ADJPREV], params[ACCESS2_ADJPREV]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['tracts']:
+        import pipeline
+        import store
+        artifact = load_model(store.load(pipeline.TRACT_STORE), os.path.join(pipeline.TRACT_STORE, store.MANIFEST),
+                              TRACT_MODEL_ARTIFACT)
+    elif sys.argv[1:2] == ['year']:
+        import store
+        partition = store.partition_dir(sys.argv[2])
+        artifact = load_model(store.load(partition), os.path.join(partition, store.MANIFEST),
+                              os.path.join(store.year_dir(sys.argv[2]), YEAR_MODEL_ARTIFACT))
+    elif sys.argv[1:2] == ['pooled']:
+        artifact = pooled_model(year_partitions())
+        print('Pooled {:,} rows of {}.'.format(artifact['nobs'], ', '.join(artifact['partitions'])))
+    else:
+        artifact = load_model()
+    for name in (STATE_EMISSIONS, CSMOKING_ADJPREV, ACCESS2_ADJPREV):
+        print("{} regression coefficient = {} (std err {}).".format(
+            name, artifact['params'][name], artifact['bse'][name]))
@@ -0,0 +1,131 @@
+"""Budget constrained allocation of the slider improvements across States.
+
+A State's reduced cases are the sum of one term per factor, and every
+term's values on the slider grid are precomputed by the scenario cube
+(ScenarioCube.state_cube, a (3, SLIDER_STEPS, States) array).  An allocation
+gives every State a slider step for every factor; score() adds up its terms
+with one gather, so whole batches of candidate allocations are scored at
+once.
+
+Costs are dollars per percentage point of a factor, a (3,) array shared by
+every State or a (States, 3) array.  With a budget for every State,
+allocate_state_budgets() scores all SLIDER_STEPS**3 allocations of each
+State and keeps the best affordable one.  With one budget for all States,
+allocate_budget() approximates the knapsack of the (State, factor) pairs
+greedily: pairs go in order of reduced cases per dollar, each up to the most
+steps the remaining budget buys, which is the optimum of the continuous
+relaxation rounded down to the slider grid.  refine() then scores batches of
+moves of steps between pairs, spending what the rounding left over.  The
+result is approximate, not the exact optimum of the knapsack.
+"""
+import numpy as np
+
+from scenario import SLIDER_STEPS
+
+# Percentage points per slider step
+STEP = 0.1
+# Rounds of moves refining a greedy allocation of a total budget
+REFINE_ROUNDS = 50
+
+
+def state_costs(costs, states):
+    """Return a (States, 3) array of costs per percentage point."""
+    costs = np.broadcast_to(np.asarray(costs, dtype=np.float64), (states, 3))
+    if not np.all(np.isfinite(costs)) or np.any(costs < 0):
+        raise ValueError('Costs must be non-negative numbers')
+    return costs
+
+
+def score(values, steps):
+    """Return the reduced cases of allocations.
+
+    ``values`` is a (3, SLIDER_STEPS, States) array of reduced cases and
+    ``steps`` a (..., States, 3) int array of slider steps.  Returns the
+    (...) totals over every State and factor.
+    """
+    steps = np.asarray(steps)
+    states = np.arange(values.shape[2])
+    return sum(values[factor, steps[..., factor], states] for factor in range(3)).sum(axis=-1)
+
+
+def allocation_cost(costs, steps):
+    """Return the (..., States) cost of allocations of slider steps."""
+    return (np.asarray(steps) * STEP * costs).sum(axis=-1)
+
+
+def allocate_state_budgets(values, costs, budgets):
+    """Return the (States, 3) steps of the most reduced cases within every State's budget."""
+    costs = state_costs(costs, values.shape[2])
+    budgets = np.broadcast_to(np.asarray(budgets, dtype=np.float64), (values.shape[2],))
+    grid = np.arange(SLIDER_STEPS) * STEP
+    steps = np.zeros((values.shape[2], 3), dtype=int)
+    for state in range(values.shape[2]):
+        # Every combination of the three sliders, the cheapest among ties
+        terms = values[:, :, state].astype(np.float64)
+        total = terms[0][:, None, None] + terms[1][None, :, None] + terms[2][None, None, :]
+        cost = (grid[:, None, None] * costs[state, 0] + grid[None, :, None] * costs[state, 1]
+                + grid[None, None, :] * costs[state, 2])
+        total[cost > budgets[state]] = -np.inf
+        best = np.flatnonzero(total == total.max())
+        steps[state] = np.unravel_index(best[np.argmin(cost.ravel()[best])], total.shape)
+    return steps
+
+
+def allocate_budget(values, costs, budget):
+    """Return the (States, 3) steps of a greedy allocation of one total budget."""
+    costs = state_costs(costs, values.shape[2])
+    gains = values[:, -1, :].T.astype(np.float64)
+    full_cost = costs * (SLIDER_STEPS - 1) * STEP
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(full_cost > 0, gains / full_cost, np.inf)
+    # Pairs that reduce no cases are never funded
+    ratio[gains <= 0] = -np.inf
+
+    steps = np.zeros((values.shape[2], 3), dtype=int)
+    remaining = float(budget)
+    for pair in np.argsort(-ratio, axis=None, kind='stable'):
+        state, factor = np.unravel_index(pair, ratio.shape)
+        if ratio[state, factor] == -np.inf:
+            break
+        step_cost = costs[state, factor] * STEP
+        affordable = SLIDER_STEPS - 1 if step_cost == 0 else int(min(SLIDER_STEPS - 1, remaining // step_cost))
+        steps[state, factor] = affordable
+        remaining -= affordable * step_cost
+    return refine(values, costs, steps, budget)
+
+
+def refine(values, costs, steps, budget, rounds=REFINE_ROUNDS):
+    """Return greedy steps improved by moving steps between (State, factor) pairs.
+
+    Every round scores the allocations that take one step off a funded pair
+    and spend it, with the budget left over, on as many steps of another pair
+    as it buys, and keeps the best of them until none reduces more cases.
+    """
+    step_costs = (costs * STEP).ravel()
+    steps = steps.ravel().copy()
+    best = score(values, steps.reshape(-1, 3))
+    for _ in range(rounds):
+        remaining = budget - (steps * step_costs).sum()
+        # Taking no step off any pair, or one step off a funded pair
+        donors = np.concatenate(([-1], np.flatnonzero(steps > 0)))
+        recipients = np.flatnonzero(steps < SLIDER_STEPS - 1)
+        donor, recipient = (grid.ravel() for grid in np.meshgrid(donors, recipients, indexing='ij'))
+        freed = remaining + np.where(donor >= 0, step_costs[donor], 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bought = np.where(step_costs[recipient] > 0, np.floor(freed / step_costs[recipient]), SLIDER_STEPS)
+        added = np.minimum(SLIDER_STEPS - 1 - steps[recipient], bought).astype(int)
+        keep = (added > 0) & (donor != recipient)
+        if not np.any(keep):
+            break
+        donor, recipient, added = donor[keep], recipient[keep], added[keep]
+
+        candidates = np.repeat(steps[None], len(donor), axis=0)
+        rows = np.arange(len(donor))
+        candidates[rows[donor >= 0], donor[donor >= 0]] -= 1
+        candidates[rows, recipient] += added
+        scores = score(values, candidates.reshape(len(donor), -1, 3))
+        if scores.max() <= best:
+            break
+        best = scores.max()
+        steps = candidates[np.argmax(scores)]
+    return steps.reshape(-1, 3)
@@ -0,0 +1,383 @@
+"""Headless build of Data/Master_Data.csv.
+
+Runs the data preparation of "Data Model and Regression.ipynb" as explicit
+stages: normalize the FIPS keys of the CDC, income and emissions data,
+aggregate the emissions of every pollutant (PM2.5 and those added by
+ASTHMA_POLLUTANTS, see pollutants.py) by county and State in one pass, join,
+fill missing values with State means and compute ``net_growth_19to64``.  The CDC data is read
+from the store of the streaming ingest (cdc.py) when there is one, otherwise
+from Data/CDC.csv.
+
+Master_Data.csv is the dataset of BASE_YEAR.  Every other year is built on
+its own from the sources in Data/years/<year> (the CDC store of ``cdc.py
+year``, the emissions of ``aqs.py <year>``) and the year's column of
+Income.csv into its partition of the columnar store, without reading or
+rebuilding the other years.
+
+The same stages build the census tract dataset from the tract store of the
+ingest (Data/cdc_tract) into the columnar store Data/tract.  Tracts take the
+emissions and income of their county.
+
+Every stage's output is cached in Data/pipeline under a hash of the stage's
+code, the helpers and constants it depends on (STAGE_DEPENDENCIES) and the
+contents of its inputs, so a rerun only recomputes the stages whose code,
+dependencies or inputs changed.  Run it with:
+
+    python pipeline.py
+    python pipeline.py year 2020
+    python pipeline.py tracts
+"""
+import hashlib
+import inspect
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import store
+from model import MASTER_DATA, file_hash
+from pollutants import POLLUTANTS
+
+CDC_DATA = os.path.join('Data', 'CDC.csv')
+# Columnar store written by the streaming CDC ingest (cdc.py), used when present
+CDC_STORE = os.path.join('Data', 'cdc')
+INCOME_DATA = os.path.join('Data', 'Income.csv')
+EMISSIONS_DATA = os.path.join('Data', 'Emissions.csv')
+CACHE_DIR = os.path.join('Data', 'pipeline')
+# Year of the sources above (the income column, emissions and CDC data) and
+# of Master_Data.csv
+BASE_YEAR = 2019
+# Tract level CDC data (cdc.py tracts) and the tract dataset built from it
+CDC_TRACT_STORE = os.path.join('Data', 'cdc_tract')
+TRACT_STORE = os.path.join('Data', 'tract')
+TRACT_CACHE_DIR = os.path.join(CACHE_DIR, 'tract')
+
+# Columns of the AQS annual summaries used by the pipeline
+EMISSIONS_COLUMNS = ['state_code', 'county_code', 'parameter_code', 'pollutant_standard', 'arithmetic_mean']
+
+# Expected population growth between 2020 and 2030 for the United States
+GROWTH_RATE = (355.1 - 332.6) / 332.6
+# Share of the population within the range of analysis (19-64)
+WORKING_AGE_SHARE = 0.6
+
+CDC_COLUMNS = ['stateabbr', 'statedesc', 'countyname', 'countyfips', 'totalpopulation',
+               'access2_adjprev', 'casthma_adjprev', 'csmoking_adjprev']
+# The tract data only has crude prevalences, stored under the county names
+TRACT_CDC_COLUMNS = ['stateabbr', 'statedesc', 'countyname', 'countyfips', 'tractfips', 'totalpopulation',
+                     'access2_crudeprev', 'casthma_crudeprev', 'csmoking_crudeprev']
+TRACT_COLUMNS = CDC_COLUMNS[:4] + ['tractfips'] + CDC_COLUMNS[4:]
+# County values filled with the State average when missing
+FILLED_COLUMNS = ['csmoking_adjprev', 'access2_adjprev', 'per_capita_income', 'casthma_adjprev']
+
+
+def frame_hash(df):
+    """Return a sha256 hex digest of a DataFrame's columns, dtypes and values."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(column) for column in df.columns], [str(dtype) for dtype in df.dtypes]]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def run_stage(func, *inputs, cache_dir=CACHE_DIR):
+    """Return func(*inputs), cached on disk by the stage's code and input contents.
+
+    The stage's code is its source and that of the helpers and constants
+    listed in STAGE_DEPENDENCIES.  Inputs are DataFrames or file paths,
+    hashed by content either way, or other values (such as a year or the
+    pollutants) hashed by their JSON.
+    """
+    digest = hashlib.sha256(inspect.getsource(func).encode())
+    for dependency in STAGE_DEPENDENCIES[func]:
+        digest.update((inspect.getsource(dependency) if callable(dependency) else json.dumps(dependency)).encode())
+    for value in inputs:
+        if isinstance(value, pd.DataFrame):
+            digest.update(frame_hash(value).encode())
+        elif isinstance(value, str):
+            digest.update(file_hash(value).encode())
+        else:
+            digest.update(json.dumps(value).encode())
+    key = digest.hexdigest()[:16]
+    path = os.path.join(cache_dir, '{}-{}.pkl'.format(func.__name__, key))
+    if os.path.exists(path):
+        print('{}: cached'.format(func.__name__))
+        return pd.read_pickle(path)
+
+    start = time.perf_counter()
+    output = func(*inputs)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Replace the outputs of earlier runs of the stage
+    for name in os.listdir(cache_dir):
+        if name.startswith(func.__name__ + '-'):
+            os.remove(os.path.join(cache_dir, name))
+    output.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    print('{}: {:,} rows in {:.2f} s'.format(func.__name__, len(output), time.perf_counter() - start))
+    return output
+
+
+def group_mean(frame, by, columns):
+    """Return the mean of columns by group, summed the way SQL AVG does.
+
+    SQLite's AVG adds the non-null values in row order with a plain running
+    sum; np.add.at accumulates in the same order, so the means (and the
+    county values filled from them) match the notebook to the last bit,
+    where pandas' compensated groupby mean can differ by an ulp.
+    """
+    codes, groups = pd.factorize(frame[by], sort=True)
+    means = {}
+    for column in columns:
+        values = frame[column].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.zeros(len(groups))
+        np.add.at(sums, codes[valid], values[valid])
+        counts = np.bincount(codes[valid], minlength=len(groups))
+        with np.errstate(invalid='ignore'):
+            means[column] = sums / counts
+    return pd.DataFrame(means, index=pd.Index(groups, name=by))
+
+
+## Sources ##
+
+def read_cdc(path):
+    return pd.read_csv(path, converters={'countyfips': str})
+
+
+def read_cdc_store(manifest_path):
+    return store.load(os.path.dirname(manifest_path))
+
+
+def read_income(path):
+    return pd.read_csv(path, converters={'GeoFips': str})
+
+
+def read_emissions(path):
+    return pd.read_csv(path, usecols=EMISSIONS_COLUMNS,
+                       converters={'state_code': str, 'county_code': str, 'parameter_code': str})
+
+
+## Stages ##
+
+def normalize_cdc(cdc):
+    # Zero padded county FIPS codes and their State and County parts
+    cdc = cdc[CDC_COLUMNS].copy()
+    cdc['countyfips'] = cdc['countyfips'].str.zfill(5)
+    cdc['StateCode'] = cdc['countyfips'].str[:2]
+    cdc['CountyCode'] = cdc['countyfips'].str[-3:]
+    return cdc
+
+
+def normalize_tracts(cdc):
+    # Zero padded county and tract FIPS codes, prevalences under the county names
+    cdc = cdc[TRACT_CDC_COLUMNS].rename(columns=lambda column: column.replace('_crudeprev', '_adjprev'))
+    cdc['countyfips'] = cdc['countyfips'].str.zfill(5)
+    cdc['tractfips'] = cdc['tractfips'].str.zfill(11)
+    cdc['StateCode'] = cdc['countyfips'].str[:2]
+    cdc['CountyCode'] = cdc['countyfips'].str[-3:]
+    return cdc[TRACT_COLUMNS + ['StateCode', 'CountyCode']]
+
+
+def normalize_income(income, year):
+    # Per capita income of the year's column
+    if str(year) not in income:
+        raise ValueError('Income data has no {} column'.format(year))
+    return pd.DataFrame({'GeoFips': income['GeoFips'].str.zfill(5), 'per_capita_income': income[str(year)]})
+
+
+def normalize_emissions(emissions):
+    emissions = emissions.copy()
+    emissions['state_code'] = emissions['state_code'].str.zfill(2)
+    emissions['county_code'] = emissions['county_code'].str.zfill(3)
+    emissions['GeoFips'] = emissions['state_code'] + emissions['county_code']
+    return emissions
+
+
+def pollutant_means(emissions, by, pollutants):
+    # Mean annual mean of every pollutant by group, in one grouped pass over
+    # the rows of all pollutants, as a column per pollutant
+    which = np.full(len(emissions), -1)
+    for index, pollutant in enumerate(pollutants):
+        rows = emissions['parameter_code'].to_numpy() == pollutant.code
+        if pollutant.standard:
+            rows &= emissions['pollutant_standard'].to_numpy() == pollutant.standard
+        which[rows] = index
+    selected = which >= 0
+    codes, groups = pd.factorize(emissions[by].to_numpy()[selected], sort=True)
+    keys = pd.DataFrame({'key': codes * len(pollutants) + which[selected],
+                         'arithmetic_mean': emissions['arithmetic_mean'].to_numpy()[selected]})
+    means = group_mean(keys, 'key', ['arithmetic_mean'])['arithmetic_mean']
+    means = means.reindex(range(len(groups) * len(pollutants))).to_numpy().reshape(len(groups), len(pollutants))
+    return pd.Index(groups, name=by), means
+
+
+def county_emissions(emissions, pollutants):
+    # Average annual mean of every county with a monitor
+    groups, means = pollutant_means(emissions, 'GeoFips', pollutants)
+    return pd.DataFrame({'county_' + pollutant.name: means[:, index] for index, pollutant in enumerate(pollutants)},
+                        index=groups).reset_index()
+
+
+def state_emissions(emissions, pollutants):
+    # Average annual mean over every monitor in the State
+    groups, means = pollutant_means(emissions, 'state_code', pollutants)
+    return pd.DataFrame({'state_' + pollutant.name: means[:, index] for index, pollutant in enumerate(pollutants)},
+                        index=groups).reset_index()
+
+
+def join(cdc, county, income, state):
+    # Left joins keep every CDC county in its original order
+    master = cdc.merge(county.rename(columns={'GeoFips': 'countyfips'}), on='countyfips', how='left')
+    master = master.merge(income.rename(columns={'GeoFips': 'countyfips'}), on='countyfips', how='left')
+    return master.merge(state.rename(columns={'state_code': 'StateCode'}), on='StateCode', how='left')
+
+
+def fill_state_means(master, pollutants):
+    master = master.copy()
+    # Fill county's with NA PM25 (or other pollutant) emissions data with average State emissions
+    for pollutant in pollutants:
+        master['county_' + pollutant.name] = master['county_' + pollutant.name].fillna(master['state_' + pollutant.name])
+
+    # Fill the remaining county values with average State values
+    means = group_mean(master, 'StateCode', FILLED_COLUMNS).reindex(master['StateCode'])
+    for column in FILLED_COLUMNS:
+        master[column + '_state'] = means[column].to_numpy()
+    for column in FILLED_COLUMNS:
+        master[column] = master[column].fillna(master[column + '_state'])
+
+    # States without any data to fill from (New Jersey) are left out
+    return master.dropna(subset=FILLED_COLUMNS).reset_index(drop=True)
+
+
+def net_growth(master):
+    # Apply growth rate to population within range of analysis (19-64)
+    master = master.copy()
+    working_age = master['totalpopulation'] * WORKING_AGE_SHARE
+    master['net_growth_19to64'] = ((working_age * (1 + GROWTH_RATE)) - working_age).astype(int)
+    return master
+
+
+# What a stage's output depends on besides its own code and inputs: the
+# helpers it calls and the constants it reads.  Pollutants are passed as
+# inputs, so ASTHMA_POLLUTANTS and the parsing of pollutants.py are hashed
+# by value.
+STAGE_DEPENDENCIES = {
+    read_cdc: [],
+    read_cdc_store: [store.load, store.read_manifest, store.FIPS],
+    read_income: [],
+    read_emissions: [EMISSIONS_COLUMNS],
+    normalize_cdc: [CDC_COLUMNS],
+    normalize_tracts: [TRACT_CDC_COLUMNS, TRACT_COLUMNS],
+    normalize_income: [],
+    normalize_emissions: [],
+    county_emissions: [pollutant_means, group_mean],
+    state_emissions: [pollutant_means, group_mean],
+    join: [],
+    fill_state_means: [group_mean, FILLED_COLUMNS],
+    net_growth: [GROWTH_RATE, WORKING_AGE_SHARE],
+}
+
+
+def assemble(stage, cdc, columns, year=BASE_YEAR, emissions_path=EMISSIONS_DATA):
+    # Join the normalized CDC rows with emissions and income, fill and grow
+    income = stage(normalize_income, stage(read_income, INCOME_DATA), year)
+    emissions = stage(normalize_emissions, stage(read_emissions, emissions_path))
+
+    master = stage(join, cdc, stage(county_emissions, emissions, POLLUTANTS), income,
+                   stage(state_emissions, emissions, POLLUTANTS))
+    master = stage(net_growth, stage(fill_state_means, master, POLLUTANTS))
+
+    # Same column order as the notebook export, then the added pollutants
+    return master[columns + ['StateCode', 'CountyCode', 'county_emissions', 'per_capita_income', 'state_emissions']
+                  + [column + '_state' for column in FILLED_COLUMNS]
+                  + ['net_growth_19to64']
+                  + [prefix + pollutant.name for pollutant in POLLUTANTS[1:] for prefix in ('county_', 'state_')]]
+
+
+def build(output=MASTER_DATA, cache_dir=CACHE_DIR):
+    """Build the master dataset, write it to output and rebuild the columnar store."""
+    def stage(func, *inputs):
+        return run_stage(func, *inputs, cache_dir=cache_dir)
+
+    cdc_manifest = os.path.join(CDC_STORE, store.MANIFEST)
+    if os.path.exists(cdc_manifest):
+        cdc = stage(normalize_cdc, stage(read_cdc_store, cdc_manifest))
+    else:
+        cdc = stage(normalize_cdc, stage(read_cdc, CDC_DATA))
+
+    master = assemble(stage, cdc, CDC_COLUMNS)
+    master.to_csv(output, index=False)
+    if output == MASTER_DATA:
+        store.build(output)
+    return master
+
+
+def year_cdc_store(year, years_dir=store.YEARS_DIR):
+    return os.path.join(store.year_dir(year, years_dir), 'cdc')
+
+
+def year_emissions(year, years_dir=store.YEARS_DIR):
+    return os.path.join(store.year_dir(year, years_dir), 'Emissions.csv')
+
+
+def year_sources(year, years_dir=store.YEARS_DIR):
+    """Return the CDC source (a store manifest or CSV) and the emissions CSV of a year.
+
+    BASE_YEAR falls back to the sources in Data when Data/years has none.
+    """
+    cdc = os.path.join(year_cdc_store(year, years_dir), store.MANIFEST)
+    emissions = year_emissions(year, years_dir)
+    if int(year) == BASE_YEAR:
+        if not os.path.exists(cdc):
+            cdc = os.path.join(CDC_STORE, store.MANIFEST)
+            if not os.path.exists(cdc):
+                cdc = CDC_DATA
+        if not os.path.exists(emissions):
+            emissions = EMISSIONS_DATA
+    if not os.path.exists(cdc):
+        raise FileNotFoundError('No CDC data for {} in {} (python cdc.py year {} <dataset id>)'.format(
+            year, os.path.dirname(cdc), year))
+    if not os.path.exists(emissions):
+        raise FileNotFoundError('No emissions for {} in {} (python aqs.py {})'.format(year, emissions, year))
+    return cdc, emissions
+
+
+def build_year(year, years_dir=store.YEARS_DIR):
+    """Build one year's dataset into its partition of the columnar store.
+
+    Only that year's sources are read and only its stages run, cached apart
+    from the other years'; the other partitions are left untouched.
+    """
+    def stage(func, *inputs):
+        return run_stage(func, *inputs, cache_dir=os.path.join(CACHE_DIR, str(year)))
+
+    cdc_source, emissions_path = year_sources(year, years_dir)
+    read = read_cdc_store if os.path.basename(cdc_source) == store.MANIFEST else read_cdc
+    master = assemble(stage, stage(normalize_cdc, stage(read, cdc_source)), CDC_COLUMNS, int(year), emissions_path)
+    store.write(master, store.partition_dir(year, years_dir), frame_hash(master))
+    return master
+
+
+def build_tracts(store_dir=TRACT_STORE, cache_dir=TRACT_CACHE_DIR):
+    """Build the tract dataset from the CDC tract store and write it as a columnar store.
+
+    The tract stages are cached apart from the county ones so building one
+    doesn't evict the other.
+    """
+    def stage(func, *inputs):
+        return run_stage(func, *inputs, cache_dir=cache_dir)
+
+    cdc = stage(normalize_tracts, stage(read_cdc_store, os.path.join(CDC_TRACT_STORE, store.MANIFEST)))
+    tracts = assemble(stage, cdc, TRACT_COLUMNS)
+    store.write(tracts, store_dir, frame_hash(tracts))
+    return tracts
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['tracts']:
+        build_tracts()
+    elif sys.argv[1:2] == ['year']:
+        build_year(int(sys.argv[2]))
+    else:
+        build()
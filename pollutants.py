@@ -0,0 +1,75 @@
+"""EPA AQS pollutants of the pipeline, model and dashboard.
+
+Data/parameters.csv catalogs the AQS parameter codes.  PM2.5 under the 2012
+annual standard is always ingested (Master_Data.csv's county_emissions and
+state_emissions); ``ASTHMA_POLLUTANTS`` adds any other codes of the catalog,
+comma separated, each optionally pinned to one pollutant standard:
+
+    ASTHMA_POLLUTANTS='44201,42602:NO2 Annual 1971'
+
+Without a standard every annual summary of the code is averaged.  The
+pipeline adds county_<name> and state_<name> columns for every added
+pollutant, named after its abbreviation in the catalog (state_o3,
+state_no2, ...).  ``ASTHMA_MODEL_POLLUTANT`` selects the pollutant whose
+State emissions the Fixed Effects model and the emissions slider use, PM2.5
+by default.
+"""
+import collections
+import os
+import re
+
+import pandas as pd
+
+PARAMETERS_DATA = os.path.join('Data', 'parameters.csv')
+
+# PM2.5 annual means under the 2012 annual standard
+PM25_PARAMETER = '88101'
+PM25_STANDARD = 'PM25 Annual 2012'
+
+# ``name`` suffixes the dataset columns, ``label`` names the pollutant on the
+# dashboard
+Pollutant = collections.namedtuple('Pollutant', ['code', 'standard', 'name', 'label', 'units'])
+
+PM25 = Pollutant(PM25_PARAMETER, PM25_STANDARD, 'emissions', 'PM 2.5', 'Micrograms/cubic meter (LC)')
+
+
+def read_catalog(path=PARAMETERS_DATA):
+    """Return the parameter catalog indexed by parameter code."""
+    return pd.read_csv(path, dtype=str).set_index('Parameter Code')
+
+
+def column_name(code, abbreviation):
+    # Lower case abbreviation as an identifier, the code when there is none
+    name = re.sub('[^0-9a-z]+', '_', str(abbreviation).lower()).strip('_') if isinstance(abbreviation, str) else ''
+    return name or 'p' + code
+
+
+def parse(spec, catalog=None):
+    """Return PM25 and the pollutants of a spec like '44201,42602:NO2 Annual 1971'."""
+    pollutants = [PM25]
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        code, _, standard = (part.strip() for part in item.partition(':'))
+        if code == PM25_PARAMETER:
+            continue
+        if catalog is None:
+            catalog = read_catalog()
+        if code not in catalog.index:
+            raise ValueError('Unknown parameter code {} (not in {})'.format(code, PARAMETERS_DATA))
+        entry = catalog.loc[code]
+        name = column_name(code, entry['Parameter Abbreviation'])
+        if name in [pollutant.name for pollutant in pollutants]:
+            raise ValueError('Pollutant {} is listed twice'.format(name))
+        pollutants.append(Pollutant(code, standard or None, name, entry['Parameter'].strip(), entry['Standard Units']))
+    return pollutants
+
+
+def select(pollutants, code):
+    """Return the pollutant of a parameter code among pollutants."""
+    for pollutant in pollutants:
+        if pollutant.code == code:
+            return pollutant
+    raise ValueError('Pollutant {} is not ingested, add it to ASTHMA_POLLUTANTS'.format(code))
+
+
+POLLUTANTS = parse(os.environ.get('ASTHMA_POLLUTANTS', ''))
+MODEL_POLLUTANT = select(POLLUTANTS, os.environ.get('ASTHMA_MODEL_POLLUTANT', PM25_PARAMETER))
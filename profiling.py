@@ -0,0 +1,66 @@
+"""Wall time of the dashboard startup phases.
+
+Set ASTHMA_PROFILE_STARTUP=1 to log how long each phase of App.py takes
+(imports, data load, model load, ...) and the total startup time.
+memory_usage() reports how much of a process' memory is shared with others.
+"""
+import logging
+import os
+import sys
+import time
+
+PROFILE_STARTUP = os.environ.get('ASTHMA_PROFILE_STARTUP', '0') == '1'
+
+logger = logging.getLogger('asthma')
+
+
+class StartupTimer:
+    """Record the wall time between consecutive startup phases."""
+
+    def __init__(self, enabled=PROFILE_STARTUP):
+        self.enabled = enabled
+        self.start = self.last = time.perf_counter()
+        self.phases = []
+
+    def phase(self, name):
+        """Record the time since the previous phase (or the start) under name."""
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.phases.append((name, elapsed))
+        self.last = now
+        if self.enabled:
+            logger.info('Startup %-14s %8.1f ms', name, elapsed * 1000)
+
+    def total(self):
+        return self.last - self.start
+
+    def report(self):
+        if self.enabled:
+            logger.info('Startup %-14s %8.1f ms', 'total', self.total() * 1000)
+
+
+def memory_usage():
+    """Return the resident, proportional, shared and private memory of this process in bytes.
+
+    Read from /proc/self/smaps_rollup (Linux).  The proportional set size
+    splits every page shared with other processes (forked workers, mapped
+    files) between them, so the PSS of all workers adds up to the memory
+    they really use.  Elsewhere only the peak resident size is known.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if line.count(':') == 1)
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': peak * (1 if sys.platform == 'darwin' else 1024), 'pss': None, 'shared': None, 'private': None}
+
+    def size(*names):
+        return sum(int(fields[name].split()[0]) for name in names) * 1024
+
+    return {
+        'rss': size('Rss'),
+        'pss': size('Pss'),
+        'shared': size('Shared_Clean', 'Shared_Dirty'),
+        'private': size('Private_Clean', 'Private_Dirty'),
+    }
@@ -0,0 +1,145 @@
+"""Lookup of base dataset rows by state and county.
+
+State names and county FIPS codes are mapped to integer row positions once at
+startup, so the dashboard filters are a gather over the selected rows instead
+of a regex scan over every county.
+"""
+import numpy as np
+import pandas as pd
+
+
+def tract_counties(tracts):
+    """Aggregate a tract dataset to one row per county.
+
+    Returns the county frame (names, FIPS code, total population and the
+    population weighted asthma rate, counties in order of first appearance)
+    and the county position of every tract.
+    """
+    codes, counties = pd.factorize(tracts['countyfips'])
+    first = np.unique(codes, return_index=True)[1]
+    population = np.bincount(codes, weights=tracts['totalpopulation'].to_numpy(dtype=np.float64))
+    cases = np.bincount(codes, weights=(tracts['totalpopulation'] * tracts['casthma_adjprev']).to_numpy())
+    frame = tracts[['stateabbr', 'statedesc', 'countyname', 'countyfips']].iloc[first].reset_index(drop=True)
+    frame['totalpopulation'] = population.astype(np.int64)
+    frame['casthma_adjprev'] = np.divide(cases, population, out=np.zeros_like(cases), where=population > 0)
+    return frame, codes
+
+
+class RegionIndex:
+    """Map state names and county FIPS codes to row positions.
+
+    ``statedesc`` and ``countyfips`` are the columns of the base dataset, one
+    entry per county, or per tract with several rows sharing a county.
+    """
+
+    def __init__(self, statedesc, countyfips):
+        states, state_codes = np.unique(np.asarray(statedesc, dtype=object), return_inverse=True)
+        self.states = list(states)
+        # Integer state code of every row, in the order of self.states
+        self.state_codes = state_codes.astype(np.intp)
+
+        # Rows of each state, as slices of the rows sorted by state
+        order = np.argsort(self.state_codes, kind='stable')
+        bounds = np.searchsorted(self.state_codes[order], np.arange(len(self.states) + 1))
+        self.state_rows = {state: order[bounds[i]:bounds[i + 1]] for i, state in enumerate(self.states)}
+        self.state_code = {state: i for i, state in enumerate(self.states)}
+
+        # Rows of each county, as slices of the rows sorted by county
+        counties, county_codes = np.unique(np.asarray(countyfips, dtype=object), return_inverse=True)
+        order = np.argsort(county_codes, kind='stable')
+        bounds = np.searchsorted(county_codes[order], np.arange(len(counties) + 1))
+        self.county_rows = {fips: order[bounds[i]:bounds[i + 1]] for i, fips in enumerate(counties)}
+
+    def rows(self, State=None, County=None):
+        """Return the sorted row positions matching the State and County Dropdowns.
+
+        An empty or missing selection doesn't filter, matching the dropdowns
+        when they are cleared. Returns None when nothing is filtered.
+        """
+        if not State and not County:
+            return None
+
+        if County:
+            selected = [self.county_rows[fips] for fips in set(County) if fips in self.county_rows]
+            rows = np.sort(np.concatenate(selected)) if selected else np.empty(0, dtype=np.intp)
+            if State:
+                codes = [self.state_code[state] for state in State if state in self.state_code]
+                rows = rows[np.isin(self.state_codes[rows], codes)]
+            return rows
+
+        selected = [self.state_rows[state] for state in set(State) if state in self.state_rows]
+        if not selected:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(selected))
+
+
+class StateRollup:
+    """Aggregate county columns by State in a single segment-sum pass.
+
+    States are ordered by (stateabbr, statedesc), like the groupby the
+    dashboard used before.
+    """
+
+    def __init__(self, stateabbr, statedesc):
+        pairs = list(zip(stateabbr, statedesc))
+        keys = sorted(set(pairs))
+        code = {key: i for i, key in enumerate(keys)}
+        self.stateabbr = np.array([abbr for abbr, _ in keys], dtype=object)
+        self.statedesc = np.array([desc for _, desc in keys], dtype=object)
+        # State group code of every row
+        self.codes = np.array([code[pair] for pair in pairs], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.stateabbr)
+
+    def present(self, rows=None):
+        """Return the positions of the States with at least one selected row."""
+        codes = self.codes if rows is None else self.codes[rows]
+        return np.flatnonzero(np.bincount(codes, minlength=len(self)))
+
+    def sum(self, values, rows=None):
+        """Sum a (columns, counties) array by State.
+
+        Returns the positions of the States with at least one selected row
+        and a (columns, those States) table of sums.  Integer columns are
+        summed exactly with one bincount; float columns use compensated
+        summation in row order so the sums match pandas' groupby exactly.
+        """
+        values = np.asarray(values)
+        codes = self.codes
+        if rows is not None:
+            codes = codes[rows]
+            values = values[:, rows]
+        states = len(self)
+        present = self.present(rows)
+
+        if values.dtype.kind in 'iu':
+            # Column k of State s lands in bin k * states + s
+            flat = (np.arange(values.shape[0])[:, None] * states + codes).ravel()
+            table = np.bincount(flat, weights=values.ravel(), minlength=values.shape[0] * states)
+            table = table.reshape(values.shape[0], states).astype(values.dtype)
+        else:
+            table = self._compensated_sum(codes, values, states)
+        return present, table[:, present]
+
+    @staticmethod
+    def _compensated_sum(codes, values, states):
+        # Kahan summation over the rows of every State at once: step j adds
+        # the j-th row of each State, so a step touches each State only once
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=states)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rank = np.arange(len(codes)) - starts[codes[order]]
+        by_rank = order[np.argsort(rank, kind='stable')]
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(rank))))
+
+        table = np.zeros((values.shape[0], states))
+        compensation = np.zeros_like(table)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            rows = by_rank[first:last]
+            group = codes[rows]
+            y = values[:, rows] - compensation[:, group]
+            t = table[:, group] + y
+            compensation[:, group] = (t - table[:, group]) - y
+            table[:, group] = t
+        return table
@@ -0,0 +1,276 @@
+"""Scenario engine for the dashboard impact calculations.
+
+The reduced asthma case formulas are linear in the slider values, so the
+per-county terms that do not depend on the sliders are computed once and any
+(Emissions, Smoking, Healthcare) scenario is evaluated in a single vectorized
+pass over contiguous float arrays.
+"""
+import os
+import time
+
+import numpy as np
+
+# Estimated cost of asthma per person (USD)
+ASTHMA_COST = 3100
+# Monetary values are reported in $100,000 USD
+MONETARY_UNIT = 100000
+
+# Factors in the order of the dashboard sliders
+FACTORS = ('Reduced_Emissions', 'Reduced_Smoking', 'Increased_Healthcare_Access')
+
+# Slider positions: 0.0 to 5.0 in 0.1 steps
+SLIDER_STEPS = 51
+
+
+class ScenarioEngine:
+    """Evaluate reduced asthma cases and monetary impacts for slider scenarios.
+
+    ``net_growth`` and ``asthma_rate`` are the per-county ``net_growth_19to64``
+    and ``casthma_adjprev`` columns; the coefficients are those of the fixed
+    effects model.
+    """
+
+    def __init__(self, net_growth, asthma_rate, state_emissions_coef, csmoking_adjprev_coef, access2_adjprev_coef):
+        self.net_growth = np.ascontiguousarray(net_growth, dtype=np.float64)
+        self.asthma_rate = np.ascontiguousarray(asthma_rate, dtype=np.float64)
+        # Cases at today's asthma rates, shared by every factor and scenario
+        self.base_cases = self.net_growth * (self.asthma_rate / 100)
+        # Change in asthma rate per percentage point of each factor
+        # (increased health care access lowers the uninsured rate, hence the sign)
+        self.coefs = np.array([state_emissions_coef, csmoking_adjprev_coef, -access2_adjprev_coef], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.net_growth)
+
+    def impacts(self, Emissions, Smoking, Healthcare):
+        """Return a (3, counties) int array of reduced cases for each factor.
+
+        The expression mirrors the original per-column formula term for term
+        so the ``astype(int)`` truncation gives identical case counts.
+        """
+        shift = self.coefs * np.array([Emissions, Smoking, Healthcare], dtype=np.float64)
+        cases = self.base_cases - (self.net_growth * ((self.asthma_rate - shift[:, None]) / 100))
+        return cases.astype(int)
+
+    def evaluate(self, Emissions, Smoking, Healthcare):
+        """Return the dashboard impact columns for a scenario as a dict of arrays."""
+        return impact_columns(self.impacts(Emissions, Smoking, Healthcare))
+
+    def scenario_impacts(self, scenarios, rows=None):
+        """Return a (scenarios, 3, counties) int array of reduced cases for each factor.
+
+        ``scenarios`` is a (scenarios, 3) array of (Emissions, Smoking,
+        Healthcare) slider values, each row gives exactly impacts() of its
+        values.  ``rows`` optionally selects the counties evaluated.
+        """
+        shift = self.coefs * np.asarray(scenarios, dtype=np.float64).reshape(-1, 3)
+        return self._shifted_impacts(shift, rows)
+
+    def sample_impacts(self, samples, Emissions, Smoking, Healthcare, rows=None):
+        """Return a (draws, 3, counties) int array of reduced cases for each factor.
+
+        ``samples`` is a (draws, 3) array of (state emissions, smoking, health
+        care access) coefficients, such as bootstrap draws; a row equal to the
+        model's coefficients gives exactly impacts().  ``rows`` optionally
+        selects the counties evaluated.
+        """
+        coefs = np.asarray(samples, dtype=np.float64) * np.array([1, 1, -1], dtype=np.float64)
+        shift = coefs * np.array([Emissions, Smoking, Healthcare], dtype=np.float64)
+        return self._shifted_impacts(shift, rows)
+
+    def _shifted_impacts(self, shift, rows):
+        # impacts() for every row of a (rows, 3) array of rate shifts
+        base_cases, net_growth, asthma_rate = self.base_cases, self.net_growth, self.asthma_rate
+        if rows is not None:
+            base_cases, net_growth, asthma_rate = base_cases[rows], net_growth[rows], asthma_rate[rows]
+        cases = base_cases - (net_growth * ((asthma_rate - shift[:, :, None]) / 100))
+        return cases.astype(int)
+
+
+class GroupedEngine:
+    """Reduced cases of a finer engine summed by group, e.g. tracts by county.
+
+    Every tract's case counts are truncated on their own like the county
+    formula's, then added up, so a county's impact is exactly the sum of its
+    tracts'.  ``codes`` is the group position of every row of ``engine``.
+    Plugs into ScenarioCube in place of a ScenarioEngine.
+    """
+
+    def __init__(self, engine, codes, groups):
+        self.engine = engine
+        self.codes = np.asarray(codes, dtype=np.intp)
+        self.groups = groups
+        # Factor k of group g lands in bin k * groups + g
+        self.bins = (np.arange(3)[:, None] * groups + self.codes).ravel()
+
+    def __len__(self):
+        return self.groups
+
+    def impacts(self, Emissions, Smoking, Healthcare):
+        """Return a (3, groups) int array of reduced cases for each factor."""
+        impacts = self.engine.impacts(Emissions, Smoking, Healthcare)
+        sums = np.bincount(self.bins, weights=impacts.ravel(), minlength=3 * self.groups)
+        return sums.reshape(3, self.groups).astype(int)
+
+    def scenario_impacts(self, scenarios, rows=None):
+        """Return a (scenarios, 3, groups) int array of reduced cases for each factor."""
+        return self._grouped(lambda members: self.engine.scenario_impacts(scenarios, members), rows)
+
+    def sample_impacts(self, samples, Emissions, Smoking, Healthcare, rows=None):
+        """Return a (draws, 3, groups) int array of reduced cases for each factor.
+
+        ``rows`` optionally selects groups by sorted position, only their
+        rows of the finer engine are evaluated.
+        """
+        return self._grouped(
+            lambda members: self.engine.sample_impacts(samples, Emissions, Smoking, Healthcare, members), rows)
+
+    def _grouped(self, impacts_of, rows):
+        # Sum the (n, 3, rows) impacts of the selected groups' rows by group
+        if rows is None:
+            members, codes, groups = None, self.codes, self.groups
+        else:
+            members = np.flatnonzero(np.isin(self.codes, rows))
+            codes, groups = np.searchsorted(rows, self.codes[members]), len(rows)
+        impacts = impacts_of(members)
+        count = len(impacts)
+        bins = ((np.arange(count * 3) * groups)[:, None] + codes).ravel()
+        sums = np.bincount(bins, weights=impacts.ravel(), minlength=count * 3 * groups)
+        return sums.reshape(count, 3, groups).astype(int)
+
+    def evaluate(self, Emissions, Smoking, Healthcare):
+        """Return the dashboard impact columns for a scenario as a dict of arrays."""
+        return impact_columns(self.impacts(Emissions, Smoking, Healthcare))
+
+
+def impact_columns(impacts):
+    """Return the dashboard impact columns for a (3, counties) array of reduced cases."""
+    total = impacts.sum(axis=0)
+    columns = {}
+    for factor, impact in zip(FACTORS, impacts):
+        columns[factor + '_Impact'] = impact
+    columns['Total_Impact'] = total
+    for factor, impact in zip(FACTORS + ('Total',), (*impacts, total)):
+        # Apply monetary societal benefit
+        monetary = impact * ASTHMA_COST
+        columns[factor + '_Monetary_Impact'] = monetary / MONETARY_UNIT
+        # State aggregation - monetary societal benefit
+        columns[factor + '_Monetary_Impact_State'] = monetary
+    return columns
+
+
+class ScenarioCube:
+    """Reduced cases for every slider position, precomputed per factor.
+
+    Each slider has SLIDER_STEPS positions and the factors are independent,
+    so the whole result space is a (3, SLIDER_STEPS, counties) int32 array.
+    A scenario on the slider grid is then a gather of three slices; values off
+    the grid fall back to the engine.  With a ``rollup`` (regions.StateRollup)
+    the State sums of every slice are precomputed too.  With a ``path`` the
+    cube is written there and memory-mapped, so processes can share it.
+    """
+
+    def __init__(self, engine, rollup=None, path=None):
+        start = time.perf_counter()
+        self.engine = engine
+        self.rollup = rollup
+
+        cube = np.empty((3, SLIDER_STEPS, len(engine)), dtype=np.int32)
+        for step in range(SLIDER_STEPS):
+            value = step / 10
+            cube[:, step] = engine.impacts(value, value, value)
+        if path is not None:
+            # Write to a temporary file first, another process may have the
+            # previous cube mapped
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, cube)
+            os.replace(path + '.tmp', path)
+            cube = np.load(path, mmap_mode='r')
+        self.cube = cube
+
+        self.state_cube = None
+        if rollup is not None:
+            _, sums = rollup.sum(cube.reshape(3 * SLIDER_STEPS, -1).astype(np.int64))
+            self.state_cube = sums.reshape(3, SLIDER_STEPS, -1)
+        self.build_seconds = time.perf_counter() - start
+
+    @property
+    def nbytes(self):
+        size = self.cube.nbytes
+        if self.state_cube is not None:
+            size += self.state_cube.nbytes
+        return size
+
+    @staticmethod
+    def steps(Emissions, Smoking, Healthcare):
+        """Return the slider grid positions, or None if any value is off the grid."""
+        steps = []
+        for value in (Emissions, Smoking, Healthcare):
+            step = round(value * 10)
+            if not 0 <= step < SLIDER_STEPS or step / 10 != value:
+                return None
+            steps.append(step)
+        return steps
+
+    def impacts(self, Emissions, Smoking, Healthcare):
+        """Return a (3, counties) int array of reduced cases for each factor."""
+        steps = self.steps(Emissions, Smoking, Healthcare)
+        if steps is None:
+            return self.engine.impacts(Emissions, Smoking, Healthcare)
+        return self.cube[[0, 1, 2], steps].astype(int)
+
+    def evaluate(self, Emissions, Smoking, Healthcare):
+        """Return the dashboard impact columns for a scenario as a dict of arrays."""
+        return impact_columns(self.impacts(Emissions, Smoking, Healthcare))
+
+    @staticmethod
+    def grid_steps(scenarios):
+        """Return the slider grid positions of a (scenarios, 3) array and which rows are on the grid."""
+        steps = np.round(scenarios * 10).astype(int)
+        on_grid = np.all((steps >= 0) & (steps < SLIDER_STEPS) & (steps / 10 == scenarios), axis=1)
+        return np.where(on_grid[:, None], steps, 0), on_grid
+
+    def scenario_impacts(self, scenarios, rows=None):
+        """Return a (scenarios, 3, counties) int array of reduced cases for each factor.
+
+        Scenarios on the slider grid are gathered from the cube, the others
+        evaluated by the engine in one pass.  ``rows`` optionally selects
+        counties by sorted position.
+        """
+        scenarios = np.asarray(scenarios, dtype=np.float64).reshape(-1, 3)
+        steps, on_grid = self.grid_steps(scenarios)
+        cube = self.cube if rows is None else self.cube[:, :, rows]
+        impacts = np.empty((len(scenarios), 3, cube.shape[2]), dtype=int)
+        impacts[on_grid] = cube[np.arange(3), steps[on_grid]]
+        if not on_grid.all():
+            impacts[~on_grid] = self.engine.scenario_impacts(scenarios[~on_grid], rows)
+        return impacts
+
+    def scenario_state_impacts(self, scenarios):
+        """Return a (scenarios, 3, States) int array of reduced cases by State.
+
+        Needs a rollup; scenarios off the slider grid are summed from their
+        county impacts.
+        """
+        scenarios = np.asarray(scenarios, dtype=np.float64).reshape(-1, 3)
+        steps, on_grid = self.grid_steps(scenarios)
+        impacts = np.empty((len(scenarios), 3, len(self.rollup)), dtype=np.int64)
+        impacts[on_grid] = self.state_cube[np.arange(3), steps[on_grid]]
+        if not on_grid.all():
+            counties = self.engine.scenario_impacts(scenarios[~on_grid])
+            table = np.zeros((counties.shape[0] * 3, len(self.rollup)), dtype=np.int64)
+            states, sums = self.rollup.sum(counties.reshape(-1, counties.shape[2]).astype(np.int64))
+            table[:, states] = sums
+            impacts[~on_grid] = table.reshape(-1, 3, len(self.rollup))
+        return impacts
+
+    def state_impacts(self, Emissions, Smoking, Healthcare):
+        """Return a (4, States) int array of reduced cases by factor and in total.
+
+        Returns None without a rollup or when a slider is off the grid.
+        """
+        steps = self.steps(Emissions, Smoking, Healthcare)
+        if self.state_cube is None or steps is None:
+            return None
+        impacts = self.state_cube[[0, 1, 2], steps]
+        return np.vstack([impacts, impacts.sum(axis=0)])
@@ -0,0 +1,240 @@
+"""Columnar binary store of the master dataset.
+
+Master_Data.csv is converted once into a directory of ``.npy`` column files
+with a JSON manifest.  The dashboard memory-maps the columns at startup, so
+no CSV is parsed and worker processes share the same pages.  The store is
+rebuilt automatically when the CSV it was built from changes, and the CSV
+stays available as an export format.
+
+Every year of data added after Master_Data.csv is a partition of its own
+(Data/years/<year>/master, built by ``python pipeline.py year <year>``), so
+adding a year writes and reading a year maps only that partition.
+
+Build or export the store with:
+
+    python store.py
+    python store.py export Data/Master_Data.csv
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from model import MASTER_DATA, file_hash
+
+STORE_DIR = os.path.join('Data', 'master')
+MANIFEST = 'columns.json'
+# Data/years/<year> holds a year's sources, its partition and the model
+# artifacts fit on it
+YEARS_DIR = os.path.join('Data', 'years')
+
+# County and tract FIPS codes are stored as fixed width, zero padded byte
+# strings of these widths
+FIPS = {'countyfips': 5, 'tractfips': 11}
+# Repeated names are stored as integer codes into a sorted list of categories
+CATEGORICAL = ('stateabbr', 'statedesc', 'countyname')
+
+
+def read_csv(csv_path=MASTER_DATA):
+    """Read the master dataset CSV with zero padded FIPS codes."""
+    df = pd.read_csv(csv_path, converters={name: str for name in FIPS})
+    for name, width in FIPS.items():
+        if name in df:
+            df[name] = df[name].str.zfill(width)
+    return df
+
+
+def column_array(values):
+    # Integers are narrowed to int32 when they fit. Floats stay float64: the
+    # dashboard truncates case counts computed from the rates, and float32
+    # rounding would change those counts. Numeric strings (the State and
+    # County codes of a DataFrame built in memory) are stored as the CSV
+    # parses them.
+    if pd.api.types.is_string_dtype(values):
+        values = pd.to_numeric(values)
+    values = np.asarray(values)
+    if values.dtype.kind == 'i':
+        info = np.iinfo(np.int32)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(np.int32)
+        return values.astype(np.int64)
+    return values.astype(np.float64)
+
+
+def save_array(path, values):
+    # Write to a temporary file first so a reader never maps a partial column
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, values)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(store_dir=STORE_DIR):
+    """Return the store manifest, or None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(store_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build(csv_path=MASTER_DATA, store_dir=STORE_DIR):
+    """Write the columnar store of a master dataset CSV and return its manifest."""
+    return write(read_csv(csv_path), store_dir, file_hash(csv_path))
+
+
+def write(df, store_dir=STORE_DIR, source_hash=None):
+    """Write a DataFrame as a columnar store and return its manifest."""
+    os.makedirs(store_dir, exist_ok=True)
+
+    columns = []
+    for name in df.columns:
+        column = {'name': name}
+        if name in FIPS:
+            values = np.asarray(df[name].astype(str).str.zfill(FIPS[name]), dtype='S{}'.format(FIPS[name]))
+        elif name in CATEGORICAL:
+            codes, categories = pd.factorize(df[name], sort=True)
+            values = codes.astype(np.int16 if len(categories) < 2**15 else np.int32)
+            column['categories'] = list(categories)
+        else:
+            values = column_array(df[name])
+        column['dtype'] = values.dtype.str
+        save_array(os.path.join(store_dir, name + '.npy'), values)
+        columns.append(column)
+
+    manifest = {'source_hash': source_hash, 'rows': len(df), 'columns': columns}
+    write_manifest(manifest, store_dir)
+    return manifest
+
+
+def write_manifest(manifest, store_dir=STORE_DIR):
+    # Written last and atomically, a reader only sees complete stores
+    tmp_path = os.path.join(store_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST))
+
+
+class StoreWriter:
+    """Write a store page by page, without holding the whole dataset in memory.
+
+    FIPS and CATEGORICAL columns are encoded like build() encodes them
+    (categories in order of first appearance rather than sorted), the other
+    columns as their ``dtypes`` entry or float64.  Pages are appended to raw
+    column files that close() turns into .npy files.
+    """
+
+    def __init__(self, columns, store_dir=STORE_DIR, dtypes=None):
+        self.store_dir = store_dir
+        self.rows = 0
+        self.dtypes = {}
+        self.categories = {}
+        for name in columns:
+            if name in FIPS:
+                self.dtypes[name] = np.dtype('S{}'.format(FIPS[name]))
+            elif name in CATEGORICAL:
+                self.dtypes[name] = np.dtype(np.int32)
+                self.categories[name] = {}
+            else:
+                self.dtypes[name] = np.dtype((dtypes or {}).get(name, np.float64))
+        self.digest = hashlib.sha256()
+        os.makedirs(store_dir, exist_ok=True)
+        self.files = {name: open(os.path.join(store_dir, name + '.raw'), 'wb') for name in self.dtypes}
+
+    def encode(self, name, values):
+        if name in FIPS:
+            return np.asarray(values.astype(str).str.zfill(FIPS[name]), dtype=self.dtypes[name])
+        if name in self.categories:
+            codes = self.categories[name]
+            return np.array([codes.setdefault(value, len(codes)) for value in values], dtype=self.dtypes[name])
+        return pd.to_numeric(values).to_numpy(dtype=self.dtypes[name])
+
+    def append(self, page):
+        """Append the store's columns of a DataFrame page."""
+        for name, f in self.files.items():
+            values = self.encode(name, page[name])
+            self.digest.update(values.tobytes())
+            values.tofile(f)
+        self.rows += len(page)
+
+    def close(self):
+        """Write the .npy column files and the manifest, and return the manifest."""
+        columns = []
+        for name, f in self.files.items():
+            f.close()
+            raw_path = os.path.join(self.store_dir, name + '.raw')
+            path = os.path.join(self.store_dir, name + '.npy')
+            dtype = self.dtypes[name]
+            with open(path + '.tmp', 'wb') as out, open(raw_path, 'rb') as raw:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (self.rows,)})
+                shutil.copyfileobj(raw, out)
+            os.replace(path + '.tmp', path)
+            os.remove(raw_path)
+            column = {'name': name, 'dtype': dtype.str}
+            if name in self.categories:
+                column['categories'] = list(self.categories[name])
+            columns.append(column)
+
+        manifest = {'source_hash': self.digest.hexdigest(), 'rows': self.rows, 'columns': columns}
+        write_manifest(manifest, self.store_dir)
+        return manifest
+
+
+def load(store_dir=STORE_DIR, manifest=None):
+    """Return the stored dataset as a DataFrame over memory-mapped columns."""
+    if manifest is None:
+        manifest = read_manifest(store_dir)
+    data = {}
+    for column in manifest['columns']:
+        values = np.load(os.path.join(store_dir, column['name'] + '.npy'), mmap_mode='r')
+        if column['name'] in FIPS:
+            values = values.astype(str)
+        elif 'categories' in column:
+            values = np.array(column['categories'], dtype=object)[values]
+        data[column['name']] = values
+    # copy=False keeps the numeric columns on the mapped pages
+    return pd.DataFrame(data, copy=False)
+
+
+def load_dataset(csv_path=MASTER_DATA, store_dir=STORE_DIR):
+    """Load the master dataset, rebuilding the store only when the CSV has changed."""
+    manifest = read_manifest(store_dir)
+    if os.path.exists(csv_path) and (manifest is None or manifest.get('source_hash') != file_hash(csv_path)):
+        manifest = build(csv_path, store_dir)
+    return load(store_dir, manifest)
+
+
+def year_dir(year, years_dir=YEARS_DIR):
+    return os.path.join(years_dir, str(year))
+
+
+def partition_dir(year, years_dir=YEARS_DIR):
+    return os.path.join(year_dir(year, years_dir), 'master')
+
+
+def partitions(years_dir=YEARS_DIR):
+    """Return the sorted years that have a complete partition."""
+    try:
+        names = os.listdir(years_dir)
+    except OSError:
+        return []
+    return sorted(int(name) for name in names
+                  if name.isdigit() and read_manifest(partition_dir(name, years_dir)) is not None)
+
+
+def export(csv_path, store_dir=STORE_DIR):
+    """Write the stored dataset back out as CSV."""
+    load(store_dir).to_csv(csv_path, index=False)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['export']:
+        export(sys.argv[2])
+    else:
+        manifest = build(*sys.argv[1:2])
+        print('{}: {:,} rows, {} columns'.format(STORE_DIR, manifest['rows'], len(manifest['columns'])))
@@ -0,0 +1,79 @@
+import json
+import os
+import random
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+App = pytest.importorskip('App')
+from cache import figure_json
+
+CALLS = 400
+THREADS = 16
+
+
+def random_views(count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.choice(['CT', 'ST']), rng.choice([None, ['Ohio'], ['Ohio', 'Texas']]), rng.choice([None, ['39049']]),
+             rng.choice([App.MONETARY, App.CASES, App.RATES]),
+             rng.randint(0, 50) / 10, rng.randint(0, 50) / 10, rng.randint(0, 50) / 10) for _ in range(count)]
+
+
+@pytest.fixture(scope='module')
+def sequential():
+    # Every view rendered one at a time
+    views = random_views(CALLS)
+    return views, [figure_json(App.display_choropleth(*view)) for view in views]
+
+
+@pytest.mark.parametrize('render', ['display_choropleth', 'cached_choropleth'])
+def test_parallel_callbacks_match_sequential(sequential, render):
+    views, expected = sequential
+    with ThreadPoolExecutor(THREADS) as pool:
+        got = list(pool.map(lambda view: figure_json(getattr(App, render)(*view)), views))
+    assert [i for i, (e, g) in enumerate(zip(expected, got)) if e != g] == []
+
+
+@pytest.mark.parametrize('scenarios,status', [([[0, 0, 0], [100, 2.55, 100]], 200), ([[100.5, 0, 0]], 400),
+                                              ([[0, -1, 0]], 400), ([[0, 0, float('inf')]], 400)])
+def test_scenarios_range(scenarios, status):
+    response = App.app.server.test_client().post('/scenarios', json={
+        'scenarios': scenarios, 'states': ['Ohio'], 'columns': ['Total_Impact']})
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize('fields,status', [({'columns': None}, 200), ({'year': App.BASE_YEAR}, 200),
+                                           ({'columns': 'Total_Impact'}, 400), ({'year': float(App.BASE_YEAR)}, 400),
+                                           ({'year': str(App.BASE_YEAR)}, 400), ({'year': True}, 400)])
+def test_scenarios_fields(fields, status):
+    body = dict({'scenarios': [[1, 1, 1]], 'states': ['Ohio']}, **fields)
+    response = App.app.server.test_client().post('/scenarios', json=body)
+    assert response.status_code == status
+    if status == 200:
+        header = response.get_json()
+        assert header['year'] == App.BASE_YEAR and isinstance(header['year'], int)
+        assert header['columns'] == App.BATCH_COLUMNS
+
+
+def test_region_intervals():
+    # A single State's interval is the interval of the total shown
+    total, details = App.interval_text('ST', ['Ohio'], None, App.CASES, 1, 2, 3)
+    (state,) = details.children[1].children[1:]
+    name, _, lower, upper = (cell.children for cell in state.children)
+    assert name == 'Ohio'
+    assert ' {} to {} '.format(lower, upper) in total.children
+
+    _, details = App.interval_text('CT', None, None, App.MONETARY, 1, 2, 3)
+    assert len(details.children[1].children) == App.INTERVAL_REGIONS + 1
+
+
+def test_clientside_sliders_stay_in_the_browser():
+    # With ASTHMA_CLIENTSIDE no server callback takes a slider as an input
+    script = ('import App, json; print(json.dumps([[i["id"] for i in d["inputs"]] for d in '
+              'App.app.server.test_client().get("/_dash-dependencies").get_json() if not d.get("clientside_function")]))')
+    env = dict(os.environ, ASTHMA_CLIENTSIDE='1')
+    output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True).stdout
+    inputs = json.loads(output.splitlines()[-1])
+    assert inputs and not any(name in App.slider_ids for names in inputs for name in names)
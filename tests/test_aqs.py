@@ -0,0 +1,179 @@
+"""aqs.fetch against a local stand-in for the AQS API serving recorded responses."""
+import http.server
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import pytest
+import requests
+
+import aqs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'aqs')
+
+EMAIL = 'test@example.com'
+KEY = 'testkey'
+STATES = ['01', '02', '04']
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """Serves fixtures/aqs/byState_<state>.json, the error response for other States.
+
+    Records every request's query, fails a State's first requests with the
+    statuses queued in ``failures`` and counts the requests in flight.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.delay = 0
+        self.reset()
+
+    def reset(self):
+        self.calls = []
+        self.failures = {}
+        self.active = self.max_active = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        server = self.server
+        with server.lock:
+            server.calls.append(query)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            queued = server.failures.get(query['state'])
+            status = queued.pop(0) if queued else 200
+        try:
+            time.sleep(server.delay)
+            if url.path != '/annualData/byState':
+                status = 404
+            if status != 200:
+                self.send_response(status)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_json(self.response(query))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def response(self, query):
+        path = os.path.join(FIXTURES, 'byState_{}.json'.format(query['state']))
+        if query['email'] != EMAIL or query['key'] != KEY or not os.path.exists(path):
+            path = os.path.join(FIXTURES, 'byState_error.json')
+        with open(path) as f:
+            data = json.load(f)
+        # The recorded responses hold every parameter, serve the requested ones
+        data['Data'] = [row for row in data['Data'] if row['parameter_code'] in query['param'].split(',')]
+        data['Header'][0]['rows'] = len(data['Data'])
+        return data
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def stand_in():
+    server = StandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def server(stand_in):
+    stand_in.reset()
+    stand_in.delay = 0
+    return stand_in
+
+
+def fetch(server, cache_dir, states=STATES, **kwargs):
+    return aqs.fetch(states, EMAIL, KEY, base_url=server.url, cache_dir=str(cache_dir), **kwargs)
+
+
+def recorded(state, params=aqs.PARAMS):
+    with open(os.path.join(FIXTURES, 'byState_{}.json'.format(state))) as f:
+        rows = json.load(f)['Data']
+    return [row for row in rows if row['parameter_code'] in params.split(',')]
+
+
+def test_fetch(server, tmp_path):
+    responses = fetch(server, tmp_path, groups=(aqs.PARAMS, '44201'))
+    assert [response['Data'] for response in responses] == [
+        recorded(state, params) for params in (aqs.PARAMS, '44201') for state in STATES]
+    assert responses[2]['Header'][0]['status'] == 'No data matched your selection'
+    assert sorted((call['param'], call['state']) for call in server.calls) == sorted(
+        (params, state) for params in (aqs.PARAMS, '44201') for state in STATES)
+    assert {(call['bdate'], call['edate']) for call in server.calls} == {(aqs.BDATE, aqs.EDATE)}
+
+
+def test_cache(server, tmp_path):
+    first = fetch(server, tmp_path)
+    assert len(server.calls) == len(STATES)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(aqs.cache_path(state, cache_dir=str(tmp_path))) for state in STATES)
+
+    # A refresh reads every cached State without a request
+    server.reset()
+    assert fetch(server, tmp_path) == first
+    assert server.calls == []
+
+    # A new params group only requests its own calls
+    second = fetch(server, tmp_path, groups=(aqs.PARAMS, '44201'))
+    assert second[:len(STATES)] == first
+    assert sorted(call['state'] for call in server.calls) == STATES
+    assert {call['param'] for call in server.calls} == {'44201'}
+
+
+def test_concurrency(server, tmp_path):
+    # Requests overlap, up to the workers at a time
+    server.delay = 0.2
+    fetch(server, tmp_path, workers=3, groups=(aqs.PARAMS, '44201'))
+    assert len(server.calls) == 6
+    assert 1 < server.max_active <= 3
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retry(server, tmp_path, status):
+    server.failures = {'01': [status], '02': [status]}
+    responses = fetch(server, tmp_path)
+    assert [response['Data'] for response in responses] == [recorded(state) for state in STATES]
+    assert sorted(call['state'] for call in server.calls) == ['01', '01', '02', '02', '04']
+
+
+def test_retries_exhausted(server, tmp_path):
+    server.failures = {'01': [500] * 2}
+    with aqs.session(retries=1) as http, pytest.raises(requests.exceptions.RetryError):
+        aqs.fetch_state(http, '01', EMAIL, KEY, base_url=server.url, cache_dir=str(tmp_path))
+    assert len(server.calls) == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_error(server, tmp_path):
+    with pytest.raises(aqs.AQSError, match='State 01: Invalid email or key'):
+        aqs.fetch(['01'], EMAIL, 'wrongkey', base_url=server.url, cache_dir=str(tmp_path))
+    # Errors aren't cached, the next fetch requests the State again
+    assert os.listdir(tmp_path) == []
+    fetch(server, tmp_path, states=['01'])
+    assert len(server.calls) == 2
@@ -0,0 +1,112 @@
+"""cdc.ingest against a Socrata stub serving Data/CDC.csv."""
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+import cdc
+import pipeline
+import store
+
+DATASET = 'i46a-9kgh'
+
+
+class Socrata(http.server.ThreadingHTTPServer):
+    """Serves the rows of a DataFrame of strings like the SODA API.
+
+    Rows are served in order of :id, with the $select columns only and null
+    fields omitted from their records, as Socrata does.  Records every
+    request's query.
+    """
+    daemon_threads = True
+
+    def __init__(self, rows):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.rows = rows
+        self.queries = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        self.server.queries.append(query)
+        if url.path != '/resource/{}.json'.format(DATASET) or query.get('$order') != ':id':
+            self.send_error(400)
+            return
+        rows = self.server.rows
+        columns = query['$select'].split(',')
+        if not set(columns) <= set(rows.columns):
+            self.send_error(400)
+            return
+        offset = int(query.get('$offset', 0))
+        page = rows[columns].iloc[offset:offset + int(query['$limit'])]
+        records = [{name: value for name, value in row.items() if isinstance(value, str)}
+                   for row in page.to_dict('records')]
+        body = json.dumps(records).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def rows():
+    # Socrata serves every value of the dataset as a string
+    return pd.read_csv(pipeline.CDC_DATA, dtype=str)
+
+
+@pytest.fixture
+def server(rows):
+    server = Socrata(rows)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_select(server):
+    with cdc.session(1) as http:
+        page = next(cdc.pages(http, page_size=10, base_url=server.url))
+    assert server.queries[0]['$select'] == ','.join(pipeline.CDC_COLUMNS)
+    assert list(page.columns) == pipeline.CDC_COLUMNS
+    pd.testing.assert_frame_equal(page, server.rows[pipeline.CDC_COLUMNS].iloc[:10])
+
+
+def test_null_fields(server, rows):
+    # Counties without the adjusted prevalences have no such fields
+    missing = rows['csmoking_adjprev'].isna()
+    assert missing.any()
+    with cdc.session(1) as http:
+        page = next(cdc.pages(http, page_size=len(rows), base_url=server.url))
+    assert page['csmoking_adjprev'].isna().equals(missing)
+    assert page['countyfips'].notna().all()
+
+
+@pytest.mark.parametrize('page_size', [1000, 1571, 5000])
+def test_ingest(server, rows, tmp_path, page_size):
+    manifest = cdc.ingest(str(tmp_path), page_size=page_size, base_url=server.url)
+    assert manifest['rows'] == len(rows)
+
+    # Pages up to a short or empty final page
+    offsets = list(range(0, len(rows) + 1, page_size))
+    assert [int(query['$offset']) for query in server.queries] == offsets
+    assert {int(query['$limit']) for query in server.queries} == {page_size}
+
+    # Copied off the memory-mapped columns
+    loaded = store.load(str(tmp_path)).copy()
+    expected = pipeline.read_cdc(pipeline.CDC_DATA)[pipeline.CDC_COLUMNS]
+    pd.testing.assert_frame_equal(loaded, expected)
+    pd.testing.assert_frame_equal(pipeline.normalize_cdc(loaded), pipeline.normalize_cdc(expected))
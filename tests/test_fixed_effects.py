@@ -0,0 +1,92 @@
+"""Moments of row partitions against a fit of the rows themselves."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixed_effects
+import model
+
+PARTS = 5
+DROPPED = 3
+RTOL = 1e-9
+
+
+@pytest.fixture(scope='module')
+def master():
+    return pd.read_csv(model.MASTER_DATA, converters={'countyfips': str})
+
+
+@pytest.fixture(scope='module')
+def data(master):
+    data = model.model_data(master)
+    y = data[model.DEPENDENT].to_numpy()
+    X = data[list(model.REGRESSORS)].to_numpy()
+    groups = data[model.GROUPS].to_numpy()
+    # Random partitions, with the first State's counties all in the first one
+    part = np.random.default_rng(0).integers(0, PARTS, len(y))
+    part[groups == groups[0]] = 0
+    return y, X, groups, part
+
+
+@pytest.fixture(scope='module')
+def parts(data):
+    # Every partition's moments as stored, through their JSON
+    y, X, groups, part = data
+    return [fixed_effects.Moments.from_dict(json.loads(json.dumps(
+        fixed_effects.Moments.from_data(y[part == i], X[part == i], groups[part == i]).to_dict())))
+        for i in range(PARTS)]
+
+
+def assert_same_fit(result, expected):
+    assert result['groups'] == expected['groups']
+    assert result['nobs'] == expected['nobs']
+    assert result['df_resid'] == expected['df_resid']
+    np.testing.assert_allclose(result['params'], expected['params'], rtol=RTOL)
+    np.testing.assert_allclose(result['bse'], expected['bse'], rtol=RTOL)
+
+
+def test_round_trip(data, parts):
+    y, X, groups, part = data
+    for i, moments in enumerate(parts):
+        direct = fixed_effects.Moments.from_data(y[part == i], X[part == i], groups[part == i])
+        assert moments.to_dict() == direct.to_dict()
+
+
+@pytest.mark.parametrize('cov_type', ['nonrobust', 'cluster'])
+def test_combined_partitions(data, parts, cov_type):
+    y, X, groups, _ = data
+    assert_same_fit(fixed_effects.fit_moments(fixed_effects.combine(parts), cov_type),
+                    fixed_effects.fit(y, X, groups, cov_type))
+
+
+@pytest.mark.parametrize('cov_type', ['nonrobust', 'cluster'])
+def test_dropped_partition(data, parts, cov_type):
+    # Dropping a stale partition is a refit without its rows
+    y, X, groups, part = data
+    keep = part != DROPPED
+    assert_same_fit(fixed_effects.fit_moments(fixed_effects.combine(parts[:DROPPED] + parts[DROPPED + 1:]), cov_type),
+                    fixed_effects.fit(y[keep], X[keep], groups[keep], cov_type))
+
+
+def test_unsupported_cov_type(parts):
+    with pytest.raises(ValueError):
+        fixed_effects.fit_moments(fixed_effects.combine(parts), 'HC1')
+
+
+# The State emissions are constant within a State, statsmodels solves the
+# rank deficient dummies by pseudoinverse like the within estimator does
+@pytest.mark.filterwarnings('ignore:The design matrix is rank-deficient')
+@pytest.mark.parametrize('cov_type', ['nonrobust', 'HC0', 'HC1', 'cluster'])
+def test_statsmodels(master, cov_type):
+    # The within estimator against the OLS of FORMULA with its State dummies
+    smf = pytest.importorskip('statsmodels.formula.api')
+    df = master.loc[model.model_data(master).index]
+    cov_kwds = {'groups': pd.factorize(df[model.GROUPS])[0]} if cov_type == 'cluster' else None
+    expected = smf.ols(model.FORMULA, data=df).fit(cov_type=cov_type, cov_kwds=cov_kwds)
+    artifact = model.fit_fixed_model(master, cov_type)
+    assert artifact['nobs'] == expected.nobs
+    assert list(artifact['params']) == list(expected.params.index)
+    np.testing.assert_allclose(list(artifact['params'].values()), expected.params, rtol=RTOL)
+    np.testing.assert_allclose(list(artifact['bse'].values()), expected.bse, rtol=RTOL)
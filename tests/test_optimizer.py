@@ -0,0 +1,72 @@
+"""Budget allocations against brute force and the greedy pass they refine."""
+import itertools
+
+import numpy as np
+import pytest
+
+import optimizer
+from scenario import SLIDER_STEPS
+
+App = pytest.importorskip('App')
+
+COSTS = np.array(App.OPTIMIZER_COSTS, dtype=np.float64)
+
+
+@pytest.fixture(scope='module')
+def values():
+    return App.base_year.cube.state_cube
+
+
+def test_score(values):
+    steps = np.random.default_rng(0).integers(0, SLIDER_STEPS, (4, values.shape[2], 3))
+    states = np.arange(values.shape[2])
+    for allocation, total in zip(steps, optimizer.score(values, steps)):
+        assert total == sum(values[factor, allocation[:, factor], states].sum() for factor in range(3))
+
+
+def test_state_budgets(values):
+    # Two States against every slider combination
+    values = values[:, :, :2]
+    steps = optimizer.allocate_state_budgets(values, COSTS, 20e6)
+    for state in range(2):
+        best = max(sum(values[factor, combination[factor], state] for factor in range(3))
+                   for combination in itertools.product(range(SLIDER_STEPS), repeat=3)
+                   if optimizer.allocation_cost(COSTS, combination) <= 20e6)
+        assert sum(values[factor, steps[state, factor], state] for factor in range(3)) == best
+        assert optimizer.allocation_cost(COSTS, steps[state]) <= 20e6
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_budget(values, seed, monkeypatch):
+    rng = np.random.default_rng(seed)
+    costs = rng.uniform(1e5, 1e7, (values.shape[2], 3)) if seed % 2 else COSTS * rng.uniform(0.2, 3, 3)
+    budget = 10 ** rng.uniform(6, 9.5)
+    steps = optimizer.allocate_budget(values, costs, budget)
+    assert steps.min() >= 0 and steps.max() <= SLIDER_STEPS - 1
+    assert optimizer.allocation_cost(optimizer.state_costs(costs, values.shape[2]), steps).sum() <= budget
+    # Never worse than the greedy pass it refines
+    monkeypatch.setattr(optimizer, 'refine', lambda values, costs, steps, budget: steps)
+    assert optimizer.score(values, steps) >= optimizer.score(values, optimizer.allocate_budget(values, costs, budget))
+
+
+@pytest.mark.filterwarnings('error')
+def test_free_pair_without_gain(values):
+    # A free pair that reduces no cases is never funded, nor divided by
+    values = values.copy()
+    values[:, :, 0] = 0
+    costs = np.tile([0, 1e6, 1e6], (values.shape[2], 1))
+    steps = optimizer.allocate_budget(values, costs, 0)
+    assert np.all(steps[0] == 0)
+    assert np.all(steps[1:, 0] == SLIDER_STEPS - 1)
+
+
+def test_no_states():
+    figure, style, summary = App.update_optimizer(1, *App.OPTIMIZER_COSTS, 'total', 1e6, ['Nowhere'], App.BASE_YEAR)
+    assert figure is App.dash.no_update
+    assert style == {'display': 'none'}
+
+
+@pytest.mark.parametrize('year,status', [(App.BASE_YEAR, 200), (float(App.BASE_YEAR), 400), (True, 400)])
+def test_optimize_year(year, status):
+    response = App.app.server.test_client().post('/optimize', json={'budget': 1e6, 'states': ['Ohio'], 'year': year})
+    assert response.status_code == status
@@ -0,0 +1,57 @@
+"""Stage caching of the pipeline."""
+import inspect
+
+import pandas as pd
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def master():
+    return pd.DataFrame({'totalpopulation': [1000, 25000, 340]})
+
+
+def run(master, tmp_path, capsys):
+    output = pipeline.run_stage(pipeline.net_growth, master, cache_dir=str(tmp_path))
+    return output, capsys.readouterr().out
+
+
+def test_cached(master, tmp_path, capsys):
+    first, out = run(master, tmp_path, capsys)
+    assert 'cached' not in out
+    second, out = run(master, tmp_path, capsys)
+    assert out == 'net_growth: cached\n'
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_inputs(master, tmp_path, capsys):
+    run(master, tmp_path, capsys)
+    _, out = run(master.assign(totalpopulation=[1000, 25000, 341]), tmp_path, capsys)
+    assert 'cached' not in out
+
+
+def test_dependencies(master, tmp_path, capsys, monkeypatch):
+    # A changed constant (as if edited, STAGE_DEPENDENCIES holds its value)
+    # reruns the stages that read it, and only those
+    first, _ = run(master, tmp_path, capsys)
+    pipeline.run_stage(pipeline.normalize_income, pd.DataFrame({'GeoFips': ['1001'], '2019': [1.0]}), 2019,
+                       cache_dir=str(tmp_path))
+    capsys.readouterr()
+
+    monkeypatch.setattr(pipeline, 'WORKING_AGE_SHARE', 0.5)
+    monkeypatch.setitem(pipeline.STAGE_DEPENDENCIES, pipeline.net_growth,
+                        [pipeline.GROWTH_RATE, pipeline.WORKING_AGE_SHARE])
+    second, out = run(master, tmp_path, capsys)
+    assert 'cached' not in out
+    assert not second['net_growth_19to64'].equals(first['net_growth_19to64'])
+    pipeline.run_stage(pipeline.normalize_income, pd.DataFrame({'GeoFips': ['1001'], '2019': [1.0]}), 2019,
+                       cache_dir=str(tmp_path))
+    assert capsys.readouterr().out == 'normalize_income: cached\n'
+
+
+def test_every_stage_has_dependencies():
+    # Every function run as a stage lists its dependencies
+    source = inspect.getsource(pipeline)
+    stages = {name for name in dir(pipeline) if 'stage({},'.format(name) in source.replace(' ', '')}
+    assert stages == {func.__name__ for func in pipeline.STAGE_DEPENDENCIES}
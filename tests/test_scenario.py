@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from model import MASTER_DATA, coefficients, fit_fixed_model
+from scenario import SLIDER_STEPS, ScenarioCube, ScenarioEngine
+
+COLUMNS = ['Reduced_Emissions', 'Reduced_Smoking', 'Increased_Healthcare_Access', 'Total']
+
+
+@pytest.fixture(scope='module')
+def data():
+    df = pd.read_csv(MASTER_DATA, converters={'countyfips': str})
+    return df, coefficients(fit_fixed_model(df))
+
+
+def baseline(df, coefs, Emissions, Smoking, Healthcare):
+    # The column by column formulas display_choropleth used before the engine
+    state_emissions_coef, csmoking_adjprev_coef, access2_adjprev_coef = coefs
+    df = df.copy()
+    df['Reduced_Emissions_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (state_emissions_coef*Emissions))/100))
+    df['Reduced_Emissions_Impact'] = df['Reduced_Emissions_Impact'].astype(int)
+    df['Reduced_Smoking_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (csmoking_adjprev_coef*Smoking))/100))
+    df['Reduced_Smoking_Impact'] = df['Reduced_Smoking_Impact'].astype(int)
+    df['Increased_Healthcare_Access_Impact'] = (df['net_growth_19to64'] * (df['casthma_adjprev']/100)) - (df['net_growth_19to64'] * ((df['casthma_adjprev'] - (-access2_adjprev_coef*Healthcare))/100))
+    df['Increased_Healthcare_Access_Impact'] = df['Increased_Healthcare_Access_Impact'].astype(int)
+    df['Total_Impact'] = df['Increased_Healthcare_Access_Impact'] + df['Reduced_Smoking_Impact'] + df['Reduced_Emissions_Impact']
+    df['Total_Impact'] = df['Total_Impact'].astype(int)
+    for column in COLUMNS:
+        df[column + '_Monetary_Impact'] = (df[column + '_Impact'] * 3100) / 100000
+        df[column + '_Monetary_Impact_State'] = (df[column + '_Impact'] * 3100)
+    return df
+
+
+def scenarios():
+    # Every grid step of every slider, random grid triples and values off the grid
+    rng = np.random.default_rng(0)
+    grid = [(step / 10,) * 3 for step in range(SLIDER_STEPS)]
+    grid += [tuple(rng.integers(0, SLIDER_STEPS, 3) / 10) for _ in range(20)]
+    return grid + [(0.05, 1.23, 4.99), (2.5, 0.33, 0.0), (0.123456, 3.3, 1.7), (5.0, 0.01, 2.25)]
+
+
+def assert_matches(results, expected):
+    for column in COLUMNS:
+        for suffix in ('_Impact', '_Monetary_Impact', '_Monetary_Impact_State'):
+            np.testing.assert_array_equal(results[column + suffix], expected[column + suffix].to_numpy())
+
+
+@pytest.mark.parametrize('scenario', scenarios())
+def test_engine_matches_column_formulas(data, scenario):
+    df, coefs = data
+    engine = ScenarioEngine(df['net_growth_19to64'], df['casthma_adjprev'], *coefs)
+    assert_matches(engine.evaluate(*scenario), baseline(df, coefs, *scenario))
+
+
+def test_cube_matches_column_formulas(data):
+    df, coefs = data
+    cube = ScenarioCube(ScenarioEngine(df['net_growth_19to64'], df['casthma_adjprev'], *coefs))
+    for scenario in scenarios():
+        assert_matches(cube.evaluate(*scenario), baseline(df, coefs, *scenario))